@@ -58,7 +58,7 @@ Password: probebench
 Root: automat10n
 ~~~~
 
-Make a directory for your work and copy this file along with *probebench.py* and the file containing the structure coordinates into it.
+Make a directory for your work and copy this file along with *probebench.py*, the other python modules in this directory (*route.py*, *pipeline.py*, *matrix.py*, *configurations.py*, *dmm.py*, *simulator.py*, *timing.py*, *journal.py*, *results.py*, *alignment.py*), *coordinates.py* from the top of the repository and the file containing the structure coordinates into it.
 
 ~~~~
 mkdir My_directory
@@ -117,6 +117,15 @@ There are currently timing issues in read and write from the probebench, if
 communication commands are sent faster than the ability of the tool to
 respond, then it will crash. If this occurs the tool/interface must be
 reset. The easiest way to achieve this is to power cycle the tool, there may be gpib based techniques of resetting and clearing the interface, however these are undeveloped.
+*probebench.py* keeps at least *delay_time* (0.5 s) between commands, counted from the previous command rather than added before every command.
+
+After each move the chuck position is polled until two consecutive readings agree (*waitArrival*), one reading every *delay_time* (0.5 s), the shortest spacing the interface accepts, so a short move is detected after about 1.2 s instead of the fixed 2.5 s.
+Moves that have not finished within 2 s plus the distance at the slowest expected stage speed stop the run.
+The previous fixed 2.5 s wait is available with *--fixed-wait*.
+
+By default the chuck is lowered to separation height before every move and raised to contact after it.
+With *--step=DISTANCE* a move of at most DISTANCE um, such as to the neighbouring structure in a block (960 um along a row of the AgCl die), only lowers the chuck to align height, which shortens the z travel of every such step; longer moves, moves to another die (the *die* column of a coordinate table from *generate_wafer_map.py*), the first move and the end of the run use full separation.
+The align height is the contact height less the gap set on the probe station, it must clear the probes from the wafer surface before stepping is used.
 
 ### Stage motion
 There are several motion strategies available, these are detailed in the PA200 documentation.
@@ -127,6 +136,19 @@ This sets a local origin at the current stage position and all supplied translat
 By default the system will use the first coordinate supplied by the file and so this structure must first be found on the sample and set as **HOME** using the manual control before starting any measurements.
 This behaviour can be overridden by supplying the row index in the coordinate list of the new **HOME** structure or other recognisable point on the sample.
 
+### Alignment
+
+With **HOME** alone the wafer must be theta aligned, any remaining rotation or scale error grows with distance from **HOME** and far dies are missed.
+Instead, after setting **HOME**, drive to two or more reference structures spread over the wafer (e.g. opposite corners, or three corners for the full fit) and note their stage positions relative to **HOME** from the controller, then supply them with *--align*:
+
+~~~~
+index,x,y
+0,0.0,0.0
+449,-15240.5,-16860.2
+~~~~
+
+*index* is the row of the structure in the coordinate file.  Two references fit offset, rotation and scale, three or more the full affine transform including separate x and y scale and skew (*alignment.py*); the fitted rotation (the theta error, 0 for a perfectly aligned wafer), scale and skew and the largest residual at the references are printed before the run.
+
 ### Probecard
 
 Probe layout: (240um pitch) Pad size - 120x120um:
@@ -196,6 +218,14 @@ The 4084B and 4085B system has 8 ports capable of connecting to 48 pins.
 
 The switching matrix should be regularly exercised to keep the relay contacts clean, a protocol is available in the manual.
 
+### Relay state
+
+*matrix.py* keeps track of the connected relays.  A configuration only switches the relays that differ from the previous one and nothing is sent when it is unchanged.
+When only connections are added just those relays are closed, and all the commands of one update are sent in a single write joined by *matrix_separator* (None sends every command on its own).
+When relays have to be opened the matrix is cleared and the configuration connected again in the same write.
+The single relay open command is not recorded here: after checking it in the 4085M GPIB reference set *matrix_open_format* (e.g. 'PC{port}OF{pin:02d}') so the relays shared with the previous configuration stay closed and only the changed ones are switched, then try it on a dry run with the probes separated.
+With *--simulate* every transition between the compiled configurations is first switched on the simulated matrix (*simulator.check_matrix*), checking the relays and that fewer writes are sent than clearing and reconnecting.
+
 ### Relay test
 
 A diagnostic is available for the switching matrix, requiring connection of 16075A relay
@@ -282,12 +312,28 @@ The coordinate file for the structure was created by examining the GDSII layout
 The start point  (**HOME**) for the AgCl structure is lower-left (LL) coordinate of contact D of the Pt LW300 structure on block 1. On the AgCl chips this is the top left structure of the top left block.
 structure in the top LHS chip.  The origin for the coordinates on each chip is the LL corner of the LL structure of the LL block on each die/chip.
 Practically, this means correctly aligning the probes over the contacts of the first structure on a theta aligned wafer is sufficient to guarantee electrical connection with all test structures.
-Configurations of the matrix are supplied for each individual measurement of the device via callback functions that return a measurement name that is stored as a field in the output data.
+Configurations of the matrix are supplied for each individual measurement of the device as a row of the *measurements* table: the contacts connected to the source, ground and voltage sense ports and the current class.
+The measurement name is stored as a field in the output data.
+The tables are compiled once before the run (*configurations.py*) so each measurement only looks up its prepared connections and SMU command.
+
+The measurement steps are sequenced by *pipeline.py*: the chuck is always separated (or lowered to align height with *--step*) and the SMU disconnected (*DZ1*) before a move, and the SMU is disconnected before any relay is switched.
+The first matrix configuration of each structure is set up while the stage is moving to it (*overlap*) and result lines are written to file by a worker thread.
 
 ### Measurement configuration
 The script allows configuration of measurement parameters for each structure.  This includes number of measurements, how each probe is connected to the instruments and the driving currents for each type of structure and material.
 For each structure these parameters are captured along with a single sampled measurement and a calculated resistance.
 
+With *--samples=N* (N>1) each configuration is measured N times in one burst into the DMM reading memory and read back in a single transfer; the burst is set up once at the start of the run so each configuration only sends the trigger and the read back, and the settle time is paid once per configuration rather than once per reading.
+The voltage and resistance are then the mean of the burst and the output gains the columns *samples*, *std*, *min*, *max* and *drift* (voltages; drift is the change over the burst from a straight line fit, a large value means the configuration had not settled).
+
+After the current is forced the DMM takes fast readings (0.1 NPLC) until two successive readings agree within *settle_tolerance*, then takes the measurement at the configured integration time.
+Low resistance lines settle in a few readings and slow structures are given up to *settle_timeout* seconds instead of a fixed 0.2 s; a measurement that does not settle is reported and the time waited is saved in the *settle* column.
+*--fixed-settle* restores the fixed 0.2 s wait.
+
+Results are collected in typed arrays and written in batches of *result_batch* rows by a worker thread (*results.py*); every row ends with the *timestamp* of the sample in seconds since the epoch.
+With *--columnar=npy* or *--columnar=parquet* the results are also written in a columnar file beside the CSV output, which loads quickly for analysis of many runs (e.g. with *coordinates.load_coordinates*).
+Each measurement is printed on one line, *--verbose* prints the previous block of lines.
+
 Usually all structures on the sample will be measured in one session, but filtering out subsets and control of the sequence the structures are measured in is possible.
 This can easily be achieved via the software but the coordinates file can also be rearranged to produce the same effect.  Some examples of filter-strings and their function:
 
@@ -317,6 +363,21 @@ Measure LW300 and LW600 structures on all materials in block 4 and only the AgCl
 
 The supplied string is passed to the *Pandas* DataFrame.query function.  The Pandas documentation should be consulted for more involved filtering requirements.
 
+### Visit order
+
+By default structures are visited in the order of the coordinate file.  Stage travel can be reduced by planning the route (*route.py*) before the run starts:
+
+\small
+~~~~
+--route=serpentine   rows of structures, alternating direction, from the row end nearest HOME
+--route=nearest      nearest neighbour from HOME
+--route=2opt         nearest neighbour improved by 2-opt and Or-opt, best for a single die
+~~~~
+\normalsize
+
+The planned stage travel and an estimate of the motion time (*stage_speed* and *move_overhead*) are printed before the first move.
+The *--offset* option counts structures in the planned order.
+
 ## Setting up a measurement run
 
 1. Power up the instruments (recommended 30 minutes prior to high precision measurements).
@@ -366,6 +427,45 @@ The supplied string is passed to the *Pandas* DataFrame.query function.  The Pan
 
 36. Results files default to a automatically named file to prevent clobbering previous data, see options to alter this behaviour.
 
+## Running without the probe station
+
+*--simulate* replaces the GPIB bus with simulated instruments (*simulator.py*) at the same addresses, so the whole run, route planning and output can be exercised and timed on any computer with *pyvisa* installed:
+
+~~~~~
+    ./agcl_example.py --simulate --measure --wafer=0 --die=0 --output=simulated.csv
+~~~~~
+
+The time per GPIB transaction is *simulate_latency*; the stage travels at *stage_speed* and DMM readings take the configured integration time, so the probebench command delays and waits are the same as on the tool.
+The transactions sent to each instrument are printed at the end of the run.
+
+## Analysis
+
+*analysis.py* reads any number of results files and pairs the plus and minus measurements. From them it computes the van der Pauw sheet resistance of every Greek cross and the squares and electrical linewidth of every line, in grouped operations over all the files at once:
+
+~~~~~
+    python analysis.py 20200907-*_wafer1_die*.csv
+~~~~~
+
+The line lengths between the voltage taps are set in the *lengths* table at the top of the module.
+
+## Resuming an interrupted run
+
+When measuring, every completed configuration and structure is recorded in a journal beside the results file (*data_journal.csv* for *data.csv*, *journal.py*).
+The journal is synced to disk with the results every *journal_interval* seconds, at the end of the run and when the run is aborted or stopped by an instrument error.
+To continue, run the same command with *--resume*: the results are appended, the structures already measured are not visited again and a structure that was interrupted part way is only measured in its missing configurations.
+Use the same filter, route and home options as the interrupted run, the journal refuses a run for a different wafer, dies or coordinate file.
+
+### Multi-die tables
+
+A coordinate table covering several dies (*generate_wafer_map.py*) is measured in one run: the *die* column of each structure is written to the results and recorded in the journal header, so *analysis.py* keeps the dies apart.
+A table of a single die, such as *AgAgCl_TS_Kelvin_R2_00_03.csv* whose *die* column is the design value, or one without a *die* column is recorded as the die given with *--die*.
+
+## Timing
+
+Every step of the run is timed (*timing.py*): stage moves and arrival, the probebench command delays and position reads, chuck contact, separation and align, matrix switching (*switching_moving* when overlapped with a move), SMU force and settle, DMM sample, result writes and the whole structure.
+When measuring each duration is logged with the structure index and configuration to *<output>_timing.jsonl* (*--timing-log=* to choose the file), and a table of count, total, p50, p95 and maximum per phase with histograms is printed at the end of the run.
+Phases can nest, the probebench command delays are also part of the move, contact and separation times.
+
 
 
 
@@ -378,11 +478,20 @@ import os
 import getopt
 import pyvisa
 import numpy
-import pandas
-import pandas as pd
 import time
 import datetime
 from probebench import Probebench
+from coordinates import load_coordinates,select_coordinates
+from route import plan_route,route_length,travel_time
+from pipeline import Pipeline
+from matrix import Matrix
+from configurations import compile_plan,compile_visits
+from dmm import DMM
+from simulator import SimulatedResourceManager,check_matrix
+from timing import PhaseTimer
+from journal import Journal
+from results import ResultSink,result_dtype
+from alignment import Alignment
 
 #default states
 dry_run = True#prevent contacting
@@ -394,10 +503,31 @@ output_file=None
 coordinates=None
 coordinate_file = '/home/probebench/20200907-Ag_AgCl_TS/AgAgCl_TS_Kelvin_R2_00_03.csv'#hard coded coordinate file
 home_index=0 #set home above the 0th item in the subset, change this if using a subset
+alignment_file = None # csv of reference structures: index (row in the coordinate file) and x,y (stage position relative to HOME, um), None uses home_index
 start_index=0#ignore structures before this index
 filter_string = 'structure == "LW300" and material == "Pt"'#first structure in each block
 filter_string_reset = False
 filter_structures = False # set to true to generate a subset of structures
+route = 'file' # visit order: file, serpentine, nearest or 2opt, see route.py
+stage_speed = 10000.0 # um/s, used only to estimate the run time
+move_overhead = 3.0 # s per move (command delays and arrival wait), used only to estimate the run time
+fixed_wait = False # sleep a fixed 2.5 s after each move instead of polling the chuck position
+overlap = True # set up the matrix for a structure while the stage is moving to it
+step_distance = None # um, moves up to this long are made at chuck align height instead of full separation, None always separates
+matrix_open_format = None # command to open one relay e.g. 'PC{port}OF{pin:02d}' once checked in the 4085M GPIB reference, None clears the matrix when relays must open
+simulate = False # use the simulated instruments in simulator.py instead of the GPIB bus
+simulate_latency = 0.002 # s per simulated GPIB transaction
+resume = False # continue an interrupted run from its journal, skipping the measurements already made
+journal_interval = 10.0 # s between journal syncs, at most this much is measured again after a crash
+output_columnar = None # also write the results as 'npy' or 'parquet' beside the output file, see results.py
+result_batch = 64 # results collected before they are handed to the writer thread
+fixed_settle = False # sleep 0.2 s after forcing the current instead of waiting for the reading to settle
+settle_tolerance = 1e-4 # relative change between successive fast readings accepted as settled
+settle_timeout = 2.0 # s, longest wait for the reading to settle
+verbose = False # print every measurement as a block of lines instead of one line
+timing_log = None # JSON lines file of every timed phase, None writes <output>_timing.jsonl when measuring
+samples = 1 # DMM readings per configuration, more than one adds the burst statistics to the output
+matrix_separator = ';' # join the commands of one matrix update into a single write, None sends them separately
 
 usage='''
 Probestation automation script\n
@@ -410,9 +540,9 @@ Probestation automation script\n
 [-w --wafer=]
        wafer number, required for measuements\n
 [-d --die=]
-       die/chip number, required for measurements\n
+       die/chip number, required for measurements; a table covering several dies records the die column of each structure instead\n
 [-c --coordinates=]
-       path to CSV file containing structure coordinates and parameters\n       default hard-coded in coordinate_file variable\n
+       path to CSV (or .npy/.parquet, see coordinates.py) file containing structure coordinates and parameters\n       default hard-coded in coordinate_file variable\n
 [-o --output=]
        path to file to write the output data to, if unsupplied a timestamped file is produced\n
 [--output-append]
@@ -425,8 +555,31 @@ Probestation automation script\n
        query to produce a subset of structures. see https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.query.html\n
 [--home]
        the index of the structure that is set as HOME; default 0\n
+[--align=]
+       csv of two or more reference structures (index,x,y) and their stage positions relative to HOME,\n       fits the wafer to stage transform instead of using HOME alone\n
 [--offset]
        the index of the structure to start measuring from; default 0\n
+[--fixed-settle]
+       wait a fixed 0.2 s after forcing the current instead of waiting for the reading to settle\n
+[--fixed-wait]
+       wait a fixed 2.5 s after each move instead of polling the stage for arrival\n
+[--step=]
+       longest move in um made at chuck align height instead of separating fully; default always separate\n
+[--route=]
+       visit order of the structures: file, serpentine, nearest or 2opt; default file\n
+       the offset refers to the position in this order\n
+[--columnar=]
+       also write the results in a columnar file beside the output: npy or parquet (needs pyarrow)\n
+[--verbose]
+       print each measurement as a block of lines\n
+[--resume]
+       continue an interrupted measurement run; needs the same --output, the journal beside it lists what was measured\n
+[--timing-log=]
+       file to log the duration of every phase as JSON lines; default beside the output file when measuring\n
+[--simulate]
+       run against simulated instruments (simulator.py), no probe station needed\n
+[--samples=]
+       readings per configuration taken in one DMM burst, mean and statistics saved; default 1\n
 
 Examples:
 
@@ -446,13 +599,21 @@ Restart a measurement run after abort, starting at structure 10 and appending to
 
 ./measure.py -m -w1 -d1 --offset=10 --output data.csv --output-append
 
+Continue an aborted run where it stopped, using the journal data_journal.csv written beside data.csv:
+
+./measure.py -m -w1 -d1 --output data.csv --resume
+
 Perform measurement over a filtered subsets of platinum structures only:
 
 ./measure.py -m -w1 -d1 --filter --filter-string="material == 'Pt'"
+
+Visit the structures in the shortest route found from HOME:
+
+./measure.py -m -w1 -d1 --route=2opt
 '''
 
 #Command line options
-opts,args = getopt.getopt(sys.argv[1:],'ho:w:d:m',['measure','dry-run','wafer=','die=','coordinates=','output=','output-overwrite','output-append','help','filter','home=','offset=','filter-string='])
+opts,args = getopt.getopt(sys.argv[1:],'ho:w:d:m',['measure','dry-run','wafer=','die=','coordinates=','output=','output-overwrite','output-append','help','filter','home=','offset=','filter-string=','route=','fixed-wait','samples=','simulate','timing-log=','resume','columnar=','verbose','align=','fixed-settle','step='])
 if opts == []:
     print(usage)
     exit()
@@ -492,7 +653,7 @@ for o,a in opts:
         append=True
     if o=='--filter':
         filter_structure=True
-    if o=='--output-file' or o=='-o':
+    if o=='--output' or o=='-o':
         output_file = a
     if o=='--home':
         try:
@@ -504,6 +665,47 @@ for o,a in opts:
     if o=='--filter-string':
         filter_string=a
         filter_string_reset=True
+    if o=='--fixed-wait':
+        fixed_wait = True
+    if o=='--fixed-settle':
+        fixed_settle = True
+    if o=='--route':
+        if a not in ['file','serpentine','nearest','2opt']:
+            print('ERROR: route {} must be one of file, serpentine, nearest or 2opt'.format(a))
+            exit()
+        route = a
+    if o=='--simulate':
+        simulate = True
+    if o=='--resume':
+        resume = True
+    if o=='--align':
+        if not os.path.isfile(a):
+            print('ERROR: alignment file {} not found'.format(a))
+            exit()
+        alignment_file = a
+    if o=='--verbose':
+        verbose = True
+    if o=='--columnar':
+        if a not in ['npy','parquet']:
+            print('ERROR: columnar format {} must be npy or parquet'.format(a))
+            exit()
+        output_columnar = a
+    if o=='--timing-log':
+        timing_log = a
+    if o=='--samples':
+        try:
+            samples = int(a)
+            assert samples>0
+        except:
+            print('ERROR: samples={} value must be a positive integer'.format(a))
+            exit()
+    if o=='--step':
+        try:
+            step_distance = float(a)
+            assert step_distance>0
+        except:
+            print('ERROR: step value must be a positive distance in um')
+            exit()
     if o=='--offset':
         try:
             start_index = int(a)
@@ -522,6 +724,12 @@ if overwrite and append:
     print('ERROR: pass either --output-overwrite or --output-append')
     exit()
 
+if resume:
+    if dry_run or output_file is None or overwrite:
+        print('ERROR: --resume needs --measure and the --output file of the interrupted run, and cannot overwrite it')
+        exit()
+    append = True
+
 
 def timestamp():
     return datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
@@ -539,6 +747,11 @@ if os.path.isfile(output_file) and not overwrite and not append:
 
 if not dry_run:
     results = open(output_file,mode=output_open_mode) # open file to store results
+    if timing_log is None:
+        timing_log = os.path.splitext(output_file)[0]+'_timing.jsonl'
+    journal_file = os.path.splitext(output_file)[0]+'_journal.csv'
+
+timer = PhaseTimer(None if timing_log is None else open(timing_log,mode=output_open_mode)) # durations of every phase, see timing.py
 
 if dry_run:
     print('INFO: dry run mode, probe contacting is disabled')
@@ -547,12 +760,12 @@ else:
     print('WARNING: probe contacting is enabled!\n<ctrl>+c to abort.')
     time.sleep(4)
 
-df = pd.read_csv('coords.csv')
+records = load_coordinates(coordinate_file,as_frame=False) # structured array of the coordinate file, a .npy file stays memory-mapped
 if filter_string_reset and not filter_structures:
     print('ERROR: filter option must be used when setting filter-string')
     exit()
 try:
-    subset = df.query(filter_string)#apply filter string
+    subset = select_coordinates(records,filter_string)#apply filter string
 except:
     print('ERROR: malformed filter query')
     exit()
@@ -562,12 +775,17 @@ if subset.empty:
 
 
 
-rm = pyvisa.ResourceManager() # create the resource manager osbject
-pb = Probebench(rm) # create a probebench object
+if simulate:
+    rm = SimulatedResourceManager(latency=simulate_latency,speed=stage_speed) # simulated bench at the same addresses
+    print('INFO: simulated instruments, {} s per transaction'.format(simulate_latency))
+else:
+    rm = pyvisa.ResourceManager() # create the resource manager osbject
+pb = Probebench(rm,timer=timer) # create a probebench object
 
  # initialise Matrix
 matrix = rm.open_resource('GPIB0::22::INSTR')
 matrix.write_termination = '\n' # taken from manual could also use "EX"
+relays = Matrix(matrix,open_format=matrix_open_format,separator=matrix_separator) # tracks the relay state so only changes are switched
 
  # initialise SMU
 smu = rm.open_resource('GPIB0::23::INSTR')
@@ -575,16 +793,10 @@ smu.read_termination = "\r\n"
 smu.write_termination = '\r\n' # taken from manual could also use "EX"
 
  # initialise DMM
-dmm = rm.open_resource('GPIB0::12::INSTR')
-dmm.read_termination = "\r\n"
-dmm.write_termination = '\r\n' # taken from manual could also use "EX"
+dmm = DMM(rm.open_resource('GPIB0::12::INSTR')) # terminations and read retries, see dmm.py
 
  # configure dmm
-dmm.write("PRESET NORM") # trying to stop any subprograms that are sending voltages
-dmm.write("TRIG HOLD")# Disable readings
-dmm.write("DCV 10") # 100nV resolution DCV 1 10nv resolution
-dmm.write("NPLC 1")
-dmm.write("TRIG SGL")# Trigger once then return to HOLD state
+dmm.configure('DCV 10',nplc=1,count=samples) # 100nV resolution DCV 1 10nv resolution, readings held until triggered, bursts of samples readings set up once
 
  # matrix pins for connecting to probes
  # These values come from examining to silkscreen on the probe card and
@@ -612,119 +824,30 @@ dmm_lo = 9
 # NOTE: indent in python  Groups together instructions (as with begin - end
 #       in other languages)
 
-#Matrix commands
-def connect(port,pin):
-    cmd = 'PC{}ON{:02d}'.format(port,pin) # generate command string for matrix
-    matrix.write(cmd)
-     #  print('matrix {} connected to {}'.format(port,pin)) # uncomment to debug
-
-def clear_matrix():
-    cmd = "CL"
-    matrix.write(cmd)
-     #  print('matrix clear') # uncomment to debug
-
 #DMM measurement
-def sample(): # need to read byte at a time otherwise causes a crash. TODO fix this
-    dmm.write("TRIG SGL")
-    message = ''
-    byte = ''
-    while byte != '\r': # look for first character of read termination
-        message += byte
-        byte = dmm.read_bytes(1)
-    return message
+def sample(): # one reading in a single transfer
+    return dmm.sample()
      #  print('dmm send sample') # uncomment to debug
 
  # Measurement configurations
-def LW300_plus(): #Test structure 1. 300 um linewidth - positive current
-    clear_matrix()
-    connect(smu1,D)
-    connect(gnd,G)
-    connect(dmm_hi,A)
-    connect(dmm_lo,H)
-    return 'LW300_plus'
-
-def LW300_minus(): #Test structure 1. 300 um linewidth - neg current
-    clear_matrix()
-    connect(smu1,G)
-    connect(gnd,D)
-    connect(dmm_hi,H)
-    connect(dmm_lo,A)
-    return 'LW300_minus'
-
-def LW600_plus(): #Test structure 2. 600 um linewidth - positive current
-    clear_matrix()
-    connect(smu1,D)
-    connect(gnd,E)
-    connect(dmm_hi,A)
-    connect(dmm_lo,F)
-    return 'LW600_plus'
-
-def LW600_minus(): #Test structure 2. 600 um linewidth - neg current
-    clear_matrix()
-    connect(smu1,E)
-    connect(gnd,D)
-    connect(dmm_hi,F)
-    connect(dmm_lo,A)
-    return 'LW600_minus'
-
-def SC300_plus(): #Test structure 3. 300 um semi circle - positive current
-    clear_matrix()
-    connect(smu1,F)
-    connect(gnd,E)
-    connect(dmm_hi,H)
-    connect(dmm_lo,G)
-    return 'SC300_plus'
-
-def SC300_minus(): #Test structure 3. 300 um semi circle - neg current
-    clear_matrix()
-    connect(smu1,E)
-    connect(gnd,F)
-    connect(dmm_hi,G)
-    connect(dmm_lo,H)
-    return 'SC300_minus'
-
- # Change this for GC20 - Greek cross - Test structure 4
- # Note that the GX measurements should be disregarded if usint AgCl layers
-
- # R_0(+I) connect D & C to DMM, connect A & B to smu
-def R_0_I_plus():
-    clear_matrix()
-    connect(smu1,A) # smu 1 to contact A
-    connect(gnd,B) # gnd to contact B
-    connect(dmm_hi,D)
-    connect(dmm_lo,C)
-    return 'R_0_I_plus'
-
-
- # R_0(-I) connect C & D to DMM, connect B & A to SMU
-def R_0_I_minus():
-    clear_matrix()
-    connect(smu1,B) # smu 1 to contact A
-    connect(gnd,A) # gnd to contact B
-    connect(dmm_hi,C)
-    connect(dmm_lo,D)
-    return 'R_0_I_minus'
-
- # R_90(+I) connect C & B to DMM, connect D & A to SMU
-def R_90_I_plus():
-    clear_matrix()
-    connect(smu1,D) # smu 1 to contact A
-    connect(gnd,A) # gnd to contact B
-    connect(dmm_hi,C)
-    connect(dmm_lo,B)
-    return 'R_90_I_plus'
-
- # R_90(-I) connect B & C to DMM, connect A & D to SMU
-def R_90_I_minus():
-    clear_matrix()
-    connect(smu1,A) # smu 1 to contact A
-    connect(gnd,D) # gnd to contact B
-    connect(dmm_hi,B)
-    connect(dmm_lo,C)
-    return 'R_90_I_minus'
-
-
-configurations = {'LW300':[LW300_plus,LW300_minus],'LW600':[LW600_minus,LW600_plus],'GC20_SC300':[R_0_I_plus,R_0_I_minus,R_90_I_plus,R_90_I_minus,SC300_plus,SC300_minus]}# measurement configurations for each structure
+ # each measurement: (source, ground, sense high, sense low, current class)
+ # the source contact is connected to smu1, ground to gnd and the sense contacts to dmm_hi and dmm_lo
+measurements = {
+    'LW300_plus':(D,G,A,H,'lw'), # Test structure 1. 300 um linewidth - positive current
+    'LW300_minus':(G,D,H,A,'lw'), # Test structure 1. 300 um linewidth - neg current
+    'LW600_plus':(D,E,A,F,'lw'), # Test structure 2. 600 um linewidth - positive current
+    'LW600_minus':(E,D,F,A,'lw'), # Test structure 2. 600 um linewidth - neg current
+    'SC300_plus':(F,E,H,G,'lw'), # Test structure 3. 300 um semi circle - positive current
+    'SC300_minus':(E,F,G,H,'lw'), # Test structure 3. 300 um semi circle - neg current
+     # GC20 - Greek cross - Test structure 4
+     # Note that the GX measurements should be disregarded if usint AgCl layers
+    'R_0_I_plus':(A,B,D,C,'rs'), # R_0(+I) connect D & C to DMM, connect A & B to smu
+    'R_0_I_minus':(B,A,C,D,'rs'), # R_0(-I) connect C & D to DMM, connect B & A to SMU
+    'R_90_I_plus':(D,A,C,B,'rs'), # R_90(+I) connect C & B to DMM, connect D & A to SMU
+    'R_90_I_minus':(A,D,B,C,'rs'), # R_90(-I) connect B & C to DMM, connect A & D to SMU
+    }
+
+configurations = {'LW300':['LW300_plus','LW300_minus'],'LW600':['LW600_minus','LW600_plus'],'GC20_SC300':['R_0_I_plus','R_0_I_minus','R_90_I_plus','R_90_I_minus','SC300_plus','SC300_minus']}# measurement configurations for each structure
 
 exponent = -6  # muA this is combined with values below when configuring the SMU - look like the unit of the forced current is are now Amps
 
@@ -732,15 +855,25 @@ measurements_lw = {'Pt':100,'Pt_Cl':100,'Ag':100,'Ag_Cl':100,'Pt_Ag':100,'Pt_Ag_
 
 measurements_rs = {'Pt':50,'Pt_Cl':50,'Ag':50,'Ag_Cl':50,'Pt_Ag':50,'Pt_Ag_Cl':50} # per material driving currents for GC20 (muA)
 
-with open(coordinate_file,'r') as f: # read the csv file into a pandas DataFrame
-    df = pandas.read_csv(f)
+ # connections, currents and SMU commands for every structure and material, built once before the run
+plan = compile_plan(configurations,measurements,{'lw':measurements_lw,'rs':measurements_rs},(smu1,gnd,dmm_hi,dmm_lo),exponent=exponent)
 
-home = pd.DataFrame([df.iloc[home_index]],index=[0]) # choose the first coordinate in the dataframe as the home position
-home_coords = home[['x','y']].values[0]*-1.0 # extract the coordinates of the home position and transform into chuck coordinates
+if alignment_file is None:
+    alignment = Alignment.home((records['x'][home_index],records['y'][home_index])) # negate and make relative to the HOME structure
+else:
+    references = load_coordinates(alignment_file) # reference structures and their stage positions relative to HOME
+    try:
+        rows = references['index'].to_numpy()
+        alignment = Alignment.fit(numpy.column_stack((records['x'][rows],records['y'][rows])),references[['x','y']].to_numpy(dtype=float))
+    except (IndexError,ValueError) as e:
+        print('ERROR: alignment from {} failed: {}'.format(alignment_file,e))
+        exit()
+    parameters = alignment.parameters()
+    print('INFO: alignment from {} references: rotation {:.4f} deg, scale {:.6f} {:.6f}, skew {:.4f} deg, largest residual {:.2f} um'.format(len(references),parameters['rotation'],parameters['scale_x'],parameters['scale_y'],parameters['skew'],numpy.abs(alignment.residuals).max()))
 
 if filter_structures==True:
     try:
-        subset = df.query(filter_string)#apply filter string
+        subset = select_coordinates(records,filter_string)#apply filter string, only the selected rows are read into a DataFrame
     except:
         print('ERROR: Malformed filter query')
         exit()
@@ -750,60 +883,124 @@ if filter_structures==True:
      #  subset = df.query('structure in ["LW300","LW600","GC20_SC300"] & material == "Pt" & block<12') # filter the structures to create a subset to visit
     df = subset
     print('filter')
-df['x'] = df['x']*-1.0 # scope is fixed and stage moves underneath so apparent motions are reversed
-df['y'] = df['y']*-1.0
+else:
+    df = select_coordinates(records) # every structure
 
-coords = zip(df.x,df.y)
-coords = [numpy.array(c)-numpy.array(home_coords) for c in coords] # establishes all structures relative to stage home position
-structure_names = df.index
-structures = zip(structure_names,coords) # creeate a list of structures to visit
+coords = alignment.apply(df[['x','y']].to_numpy(dtype=float)) # stage positions of all structures relative to HOME, see alignment.py
+order = plan_route(coords,route,start=numpy.zeros(2)) # the stage starts over HOME
+df = df.iloc[order]
+coords = coords[order]
+print('INFO: {} route over {} structures, {:.1f} mm stage travel, about {:.0f} s of motion'.format(route,len(coords),route_length(coords,range(len(coords)),numpy.zeros(2))/1000.0,travel_time(coords,range(len(coords)),numpy.zeros(2),stage_speed,move_overhead)))
+try:
+    visits,plans = compile_visits(df,coords,plan) # one typed record per structure in visit order, see configurations.py
+except KeyError as e:
+    print('ERROR: {}'.format(e))
+    exit()
+dies = numpy.unique(visits['die'])
+if die is not None and len(dies)<=1:
+    visits['die'] = die # a single die table (or one without a die column) is the die given with --die
+    dies = numpy.array([die])
+if simulate:
+    try:
+        tracked,cleared = check_matrix(plans,open_format=matrix_open_format,separator=matrix_separator) # every configuration transition on the simulated matrix
+    except RuntimeError as e:
+        print('ERROR: {}'.format(e))
+        exit()
+    print('INFO: matrix transitions checked, {} writes and {} relay operations, clearing and reconnecting needs {} and {}'.format(*tracked,*cleared))
 
-if len(structures)<start_index:
+if len(visits)<start_index:
     print('start index out of bounds')
     exit()
 
-results.write('index,wafer,die,block,material,structure,config,current,voltage,resistance\n')
+sink = None
+if not dry_run:
+    names = [(material,structure,configuration.name) for (structure,material),selected in plan.items() for configuration in selected]
+    widths = [max(len(name[n]) for name in names) for n in range(3)]
+    columnar = None if output_columnar is None else os.path.splitext(output_file)[0]+'.'+output_columnar
+    sink = ResultSink(results,result_dtype(*widths,statistics=samples>1),columnar=columnar,batch=result_batch,header=not resume) # typed rows written in batches, see results.py
+pipeline = Pipeline(pb,smu,relays,results=sink,fixed_wait=fixed_wait,overlap=overlap,step_distance=step_distance,timer=timer) # safety ordering, overlapped matrix setup and file writes
+journal = None
+if not dry_run:
+    try:
+        journal = Journal(journal_file,header='wafer {} die {} coordinates {}'.format(wafer,','.join(str(d) for d in dies),os.path.basename(coordinate_file)),resume=resume,flush=pipeline.sync,interval=journal_interval) # completed measurements, see journal.py
+    except ValueError as e:
+        print('ERROR: {}'.format(e))
+        exit()
+visits = visits[start_index:]
+if journal is not None:
+    visits = visits[[not journal.done(key) for key in visits['key'].tolist()]] # structures still to measure
+if resume:
+    print('INFO: resuming from {}, {} structures remaining'.format(journal_file,len(visits)))
 #perform the measurement
-pb.chuckSeparation() # ensure/chuck is separated before moving, hardware also ensures this
-for i,structure in enumerate(structures): # iterate over all structures
-    if i < start_index:#ignore structures before start index
-        continue
-    pb.translate(*structure[1])
-    time.sleep(2.5) # wait in seconds to arrive TODO replace with chuck status check
-    if not dry_run:
-        pb.chuckContact() # move z stage to probe contact position
-    time.sleep(0.5) # wait for contact to occur
-    smu.write('DZ1') # ensure the smu is disconnected
-    material = df.iloc[i].material # get the material type of this structure
-    structure_type = df.iloc[i].structure # get the structure type
-    block = df.iloc[i].block#extract the block value of the structure
-
-    smu.write('DZ1') # measure the smu is disconnected
-    selected_configs = configurations[structure_type] # choose measurement configurations based on structure type
-    for configuration in selected_configs:
-        config  = configuration() # setup the appropriate configuration
-        if configuration in [R_0_I_plus,R_0_I_minus,R_90_I_plus,R_90_I_minus]: # if configured for sheet resistance use those currents
-            current_value = measurements_rs[material] # pick from sheet resistance currents
-        else:
-            current_value = measurements_lw[material] # pick from linewidth currents
-        smu.write('CN1')
-        smu.write('DI1,0,{}E{},10'.format(current_value,exponent)) # set SMU constant current
-        time.sleep(0.2) # allow to settle
-        samp = sample() # get a sample from dmm
-        current = current_value*10**exponent
-        resistance = samp/current
+try:
+    for i,key,x,y,die_id,block,material,structure_type,plan_id in visits.tolist(): # iterate over the structures to measure, i is the position in the route
+        selected_configs = plans[plan_id] # prepared measurement configurations for this structure type and material
+        if journal is not None:
+            selected_configs = [configuration for configuration in selected_configs if not journal.done(key,configuration.name)] # not yet measured
+            if not selected_configs: # every configuration measured before the interruption
+                journal.record(key)
+                continue
+        structure_start = time.perf_counter()
+        timer.set(index=i,structure=structure_type)
+
+        prepared = pipeline.move(x,y,configuration=selected_configs[0],die=die_id) # separate, move and set up the first configuration while the stage travels
         if not dry_run:
-            results.write('{},{},{},{},{},{},{},{},{},{}\n'.format(i,wafer,die,block,material,structure_type,config,current,samp,resistance)) # write sample along with structure information to file
-            print('index: {}\nwafer: {}\ndie: {}\nblock: {}\nmaterial: {}\nstructure: {}\nmeasurement: {}\ncurrent: {}\nvoltage: {}\nresistance: {}\n{}\n'.format(i,wafer,die,block,material,structure_type,config,current,samp,resistance,'-'*40))
-        else:
-            print('index: {}\nwafer: {}\ndie: {}\nblock: {}\nmaterial: {}\nstructure: {}\n{}\n'.format(i,wafer,die,block,material,structure_type,config,current,samp,resistance,'-'*40))
-        smu.write('DZ1') # TODO double check this disable to smu
-    pb.chuckSeparation() # separate contacts after measurements
-    print('='*40) # delineate each structure
-     #  time.sleep(1)
-
-results.close()#close the data file
-print('Complete')
+            pipeline.contact() # move z stage to probe contact position
+        timer.sleep('contact_wait',0.5) # wait for contact to occur
+        for n,configuration in enumerate(selected_configs):
+            if n==0 and prepared is not None:
+                config = prepared # already set up during the move
+            else:
+                config  = pipeline.configure(configuration) # disconnect the smu and setup the appropriate configuration
+            timer.set(index=i,structure=structure_type,config=config)
+            pipeline.force(configuration.command) # set SMU constant current
+            if fixed_settle:
+                timer.sleep('settle',0.2) # allow to settle
+                settle_time = 0.2
+            else:
+                with timer.phase('settle'):
+                    settle_time,settled = dmm.settle(tolerance=settle_tolerance,timeout=settle_timeout) # fast readings until the voltage stops changing
+                if not settled:
+                    print('WARNING: {} {} not settled within {} s'.format(key,config,settle_timeout))
+            with timer.phase('sample'):
+                if samples>1:
+                    stats = dmm.acquire(samples) # burst of readings in one transfer
+                    samp = stats['mean']
+                else:
+                    samp = sample() # get a sample from dmm
+            current = configuration.current
+            resistance = samp/current
+            if not dry_run:
+                row = (i,wafer,die_id,block,material,structure_type,config,current,samp,resistance)
+                if samples>1:
+                    row += (stats['samples'],stats['std'],stats['min'],stats['max'],stats['drift'])
+                pipeline.write(row+(settle_time,time.time())) # write sample along with structure information to file
+                journal.record(key,config)
+            if not verbose:
+                print('{} {} {} {} {} I={} V={} R={}'.format(i,block,material,structure_type,config,current,samp,resistance)) # one line per measurement
+            elif not dry_run:
+                print('index: {}\nwafer: {}\ndie: {}\nblock: {}\nmaterial: {}\nstructure: {}\nmeasurement: {}\ncurrent: {}\nvoltage: {}\nresistance: {}\n{}\n'.format(i,wafer,die_id,block,material,structure_type,config,current,samp,resistance,'-'*40))
+            else:
+                print('index: {}\nwafer: {}\ndie: {}\nblock: {}\nmaterial: {}\nstructure: {}\n{}\n'.format(i,wafer,die_id,block,material,structure_type,config,current,samp,resistance,'-'*40))
+            pipeline.disconnect() # disable the smu
+        if step_distance is None:
+            pipeline.separate() # separate contacts after measurements
+        # when stepping the next move lowers the chuck to align or separation height depending on its length
+        if journal is not None:
+            journal.record(key) # structure complete
+        timer.set(index=i,structure=structure_type)
+        timer.record('structure',time.perf_counter()-structure_start)
+        print('='*40) # delineate each structure
+finally: # also on an abort or instrument error, so the journal matches the results file
+    if journal is not None:
+        journal.close() # results and journal on disk
+    pipeline.close() # disconnect, separate and close the data file
+print('Complete: {} matrix writes, {} matrix commands, {} relay operations'.format(relays.writes,relays.commands,relays.switched))
+if simulate:
+    print('Simulated (writes, reads) per instrument: {}'.format(rm.commands()))
+print(timer.summary()) # where the time went, per phase
+if timer.log is not None:
+    timer.log.close()
 '''
 ~~~~
 '''
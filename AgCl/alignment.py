@@ -0,0 +1,71 @@
+'''
+Wafer to stage coordinate alignment.
+
+Stage positions are an affine transform of the coordinate file positions, stage = M xy + offset, applied to the whole coordinate table in one operation.
+The transform is fitted to reference structures whose stage positions have been found with the manual controller:
+
+* two references fit offset, rotation and a uniform scale (similarity)
+* three or more references fit the full affine transform (offset, rotation, scale in x and y, skew) by least squares, and report the residual of every reference
+
+Without references the transform is the previous behaviour: the coordinates are negated (the stage moves underneath a fixed scope) and made relative to the HOME structure, i.e. a rotation by 180 degrees about HOME.
+*parameters* reports the rotation relative to these 180 degrees, so it is the theta error of the wafer.
+'''
+import numpy
+
+
+class Alignment:
+    '''
+    affine map from coordinate file positions to stage positions
+    '''
+    def __init__(self,matrix=None,offset=None):
+        self.matrix = numpy.eye(2) if matrix is None else numpy.asarray(matrix,dtype=float)
+        self.offset = numpy.zeros(2) if offset is None else numpy.asarray(offset,dtype=float)
+        self.residuals = numpy.zeros((0,2))#stage minus fitted position of each reference
+
+    @classmethod
+    def home(cls,home_xy):
+        #negate and make relative to the HOME structure at home_xy in the coordinate file
+        return cls(-numpy.eye(2),numpy.asarray(home_xy,dtype=float))
+
+    @classmethod
+    def fit(cls,xy,stage):
+        '''
+        fit from reference positions xy in the coordinate file and their stage positions, both [n,2]
+        '''
+        xy = numpy.asarray(xy,dtype=float).reshape(-1,2)
+        stage = numpy.asarray(stage,dtype=float).reshape(-1,2)
+        if xy.shape[0]<2 or xy.shape!=stage.shape:
+            raise ValueError('alignment needs two or more references with stage positions')
+        if xy.shape[0]==2:
+            #similarity as a complex multiply, stage = a*z+b
+            z = xy[:,0]+1j*xy[:,1]
+            w = stage[:,0]+1j*stage[:,1]
+            if z[1]==z[0]:
+                raise ValueError('alignment references must be at different positions')
+            a = (w[1]-w[0])/(z[1]-z[0])
+            b = w[0]-a*z[0]
+            alignment = cls([[a.real,-a.imag],[a.imag,a.real]],[b.real,b.imag])
+        else:
+            design = numpy.column_stack([xy,numpy.ones(xy.shape[0])])
+            solution,_,rank,_ = numpy.linalg.lstsq(design,stage,rcond=None)
+            if rank<3:
+                raise ValueError('alignment references must not lie on one line')
+            alignment = cls(solution[:2].T,solution[2])
+        alignment.residuals = stage-alignment.apply(xy)
+        return alignment
+
+    def apply(self,xy):
+        #stage positions of coordinate file positions [...,2]
+        return numpy.asarray(xy,dtype=float)@self.matrix.T+self.offset
+
+    def parameters(self):
+        '''
+        rotation (degrees), x and y scale, skew (degrees) and offset of the transform
+        the rotation is the theta error, relative to the nominal 180 degrees of the negated mapping and between -180 and 180
+        '''
+        (a,b),(c,d) = -self.matrix
+        scale_x = numpy.hypot(a,c)
+        rotation = numpy.arctan2(c,a)
+        shear = (a*b+c*d)/scale_x
+        scale_y = (a*d-b*c)/scale_x
+        return {'rotation':numpy.degrees(rotation),'scale_x':scale_x,'scale_y':scale_y,'skew':numpy.degrees(numpy.arctan2(shear,scale_y)),'offset':self.offset}
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+import sys
+import numpy
+import pandas
+from coordinates import load_coordinates
+
+'''
+Electrical parameters from measurement results.
+
+Results files (.csv, .npy or .parquet, see *results.py*) from any number of runs are concatenated and every step is a grouped pandas/NumPy operation over the whole table, so a lot is analysed at once:
+
+* *pair_polarity*: the *_plus* and *_minus* measurements of each structure are averaged, which removes thermal EMFs and offsets; the relative difference between them is kept as *asymmetry*.  Repeated measurements (e.g. after resuming a run) are averaged first.
+* *sheet_resistance*: van der Pauw sheet resistance of each Greek cross from R_0 and R_90, solving exp(-pi R_0/Rs)+exp(-pi R_90/Rs) = 1.  For a symmetric cross this is pi/ln(2) R.
+* *linewidth*: the number of squares R/Rs of each line (LW300, LW600, SC300, ...) using the sheet resistance of the Greek cross of the same material in the same block, and the electrical linewidth L Rs/R where the line length L between the voltage taps is given in *lengths*.
+* *summarise*: count, mean, standard deviation, median, minimum and maximum of a parameter per group.
+
+Resistances are taken as magnitudes so both sign conventions for the reversed measurement give the same result.
+
+Run on one or more results files, writing the tables named below:
+
+~~~~
+python analysis.py wafer1_die1.csv wafer1_die2.csv
+~~~~
+'''
+
+keys = ['wafer','die','block','material','structure']#identify one structure across runs
+cross_pairs = ('R_0_I','R_90_I')#measurement pairs of the Greek cross
+lengths = {}#line length between the voltage taps in um per measurement pair, e.g. {'LW300':..., 'SC300':...}
+output_pairs = 'paired.csv'
+output_sheet = 'sheet_resistance.csv'
+output_lines = 'linewidth.csv'
+
+
+def load_results(filenames):
+    #one table from several results files, source is the position of the file in filenames
+    tables = []
+    for n,filename in enumerate(filenames):
+        table = load_coordinates(filename)
+        table['source'] = n
+        tables.append(table)
+    return pandas.concat(tables,ignore_index=True)
+
+def pair_polarity(results):
+    '''
+    one row per structure and measurement pair with the plus, minus and mean resistance and their asymmetry
+    '''
+    codes,names = pandas.factorize(results['config'])#split each distinct configuration name once
+    names = pandas.Series(names.astype(str))
+    polarity = names.str.extract(r'_(plus|minus)$',expand=False).fillna('plus')
+    pair = names.str.replace(r'_(plus|minus)$','',regex=True)
+    table = results[keys].copy()
+    table['pair'] = pair.to_numpy()[codes]
+    table['polarity'] = polarity.to_numpy()[codes]
+    table['resistance'] = results['resistance'].abs()
+    paired = table.groupby(keys+['pair','polarity'],sort=False,observed=True)['resistance'].mean().unstack('polarity')
+    paired = paired.reindex(columns=['plus','minus'])
+    paired['resistance'] = paired[['plus','minus']].mean(axis=1)
+    paired['asymmetry'] = (paired['plus']-paired['minus'])/paired['resistance']
+    return paired.reset_index()
+
+def van_der_pauw(r0,r90,iterations=20):
+    #sheet resistance from two perpendicular four point resistances, Newton iteration from the symmetric solution
+    r0 = numpy.asarray(r0,dtype=float)
+    r90 = numpy.asarray(r90,dtype=float)
+    rs = numpy.pi/numpy.log(2.0)*(r0+r90)/2.0
+    for n in range(iterations):
+        a = numpy.exp(-numpy.pi*r0/rs)
+        b = numpy.exp(-numpy.pi*r90/rs)
+        f = a+b-1.0
+        df = (a*r0+b*r90)*numpy.pi/rs**2
+        rs = rs-f/df
+    return rs
+
+def sheet_resistance(paired):
+    #one row per Greek cross with R_0, R_90 and the sheet resistance Rs (ohm/sq)
+    r0,r90 = cross_pairs
+    cross = paired[paired['pair'].isin(cross_pairs)].pivot_table(index=keys,columns='pair',values='resistance',aggfunc='mean',observed=True)
+    cross = cross.reindex(columns=[r0,r90]).rename(columns={r0:'R_0',r90:'R_90'})
+    cross['Rs'] = van_der_pauw(cross['R_0'],cross['R_90'])
+    cross['anisotropy'] = (cross['R_0']-cross['R_90'])/(cross['R_0']+cross['R_90'])*2.0
+    return cross.reset_index()
+
+def linewidth(paired,sheet):
+    '''
+    one row per line measurement with its resistance, the sheet resistance of the cross in the same block and material,
+    the number of squares and, where the length is known, the electrical linewidth (um)
+    '''
+    lines = paired[~paired['pair'].isin(cross_pairs)]
+    site = ['wafer','die','block','material']
+    rs = sheet.groupby(site,observed=True)['Rs'].mean().rename('Rs')
+    lines = lines.join(rs,on=site)
+    lines['squares'] = lines['resistance']/lines['Rs']
+    lines['length'] = lines['pair'].map(lengths).astype(float)
+    lines['width'] = lines['length']/lines['squares']
+    return lines.reset_index(drop=True)
+
+def summarise(table,value,by=('material','pair')):
+    #statistics of one parameter per group
+    by = [name for name in by if name in table.columns]
+    return table.groupby(by,observed=True)[value].agg(['count','mean','std','median','min','max'])
+
+if __name__ == '__main__':
+    if len(sys.argv)<2:
+        print('usage: analysis.py results [results ...]')
+        exit()
+    results = load_results(sys.argv[1:])
+    paired = pair_polarity(results)
+    sheet = sheet_resistance(paired)
+    lines = linewidth(paired,sheet)
+    paired.to_csv(output_pairs,index=False)
+    sheet.to_csv(output_sheet,index=False)
+    lines.to_csv(output_lines,index=False)
+    print('{} results, {} paired measurements, {} crosses, {} lines'.format(len(results),len(paired),len(sheet),len(lines)))
+    print(summarise(sheet,'Rs',by=('material',)))
+    print(summarise(lines,'width' if lines['width'].notna().any() else 'squares'))
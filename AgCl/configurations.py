@@ -0,0 +1,79 @@
+'''
+Measurement configuration tables.
+
+Each measurement is a row of a table rather than a function: the probe contacts used as source, ground, voltage sense high and sense low, and the current class that selects the per-material driving current.
+Measurement names end in *_plus* or *_minus*; the two polarities of one measurement share the rest of the name.
+
+The tables are compiled once before the run into a plan with, for every structure type and material, the ordered list of configurations with their matrix connections, forced current and SMU command already built.
+
+The structures to visit are compiled in the same way into a NumPy structured array, one typed record per structure in visit order with its stage position and the index of its configuration list, so the measurement loop does no table lookups.
+'''
+import numpy
+
+
+class Configuration:
+    '''
+    one compiled measurement configuration
+    '''
+    __slots__ = ('name','connections','current','command','current_class','pair','polarity')
+
+    def __init__(self,name,connections,current,command,current_class):
+        self.name = name
+        self.connections = connections#((port,pin),...)
+        self.current = current#A
+        self.command = command#SMU source command
+        self.current_class = current_class
+        self.pair,sign = name.rsplit('_',1) if name.endswith(('_plus','_minus')) else (name,'plus')
+        self.polarity = 1 if sign=='plus' else -1
+
+def compile_plan(structures,measurements,currents,ports,exponent=-6,channel=1,compliance=10):
+    '''
+    structures: structure type -> [measurement names] in measurement order
+    measurements: name -> (source,ground,sense high,sense low,current class) probe contacts
+    currents: current class -> {material: current in units of 10**exponent A}
+    ports: (source,ground,sense high,sense low) matrix ports
+    returns {(structure type,material): [Configuration,...]}
+    '''
+    materials = set()
+    for table in currents.values():
+        materials.update(table)
+    plan = {}
+    for structure,names in structures.items():
+        for material in materials:
+            plan[(structure,material)] = []
+            for name in names:
+                *pins,current_class = measurements[name]
+                value = currents[current_class][material]
+                command = 'DI{},0,{}E{},{}'.format(channel,value,exponent,compliance)
+                connections = tuple(zip(ports,pins))
+                plan[(structure,material)].append(Configuration(name,connections,value*10**exponent,command,current_class))
+    return plan
+
+def compile_visits(table,coords,plan):
+    '''
+    table: coordinate DataFrame in visit order with block, material and structure columns and optionally die, its index identifies each structure
+    coords: stage positions [n,2] in the same order
+    plan: from compile_plan
+    returns (visits,configurations): one record per structure (position in the visit order, key, x, y, die, block, material, structure, plan)
+    and the configuration lists indexed by the plan field
+    '''
+    keys = list(plan)
+    ids = {key:n for n,key in enumerate(keys)}
+    material = table['material'].to_numpy(dtype=str)
+    structure = table['structure'].to_numpy(dtype=str)
+    plan_ids = numpy.array([ids.get(key,-1) for key in zip(structure,material)],dtype='i4')
+    if numpy.any(plan_ids<0):
+        missing = sorted(set((s,m) for s,m,n in zip(structure,material,plan_ids) if n<0))
+        raise KeyError('no measurement configurations for {}'.format(missing))
+    visits = numpy.zeros(len(table),dtype=[('position','i4'),('key','i8'),('x','f8'),('y','f8'),('die','i4'),('block','i4'),
+                                            ('material',material.dtype),('structure',structure.dtype),('plan','i4')])
+    visits['position'] = numpy.arange(len(table))
+    visits['key'] = table.index.to_numpy()
+    visits['x'],visits['y'] = numpy.asarray(coords,dtype=float).reshape(-1,2).T
+    if 'die' in table.columns:
+        visits['die'] = table['die'].to_numpy()
+    visits['block'] = table['block'].to_numpy()
+    visits['material'] = material
+    visits['structure'] = structure
+    visits['plan'] = plan_ids
+    return visits,[plan[key] for key in keys]
@@ -0,0 +1,113 @@
+'''
+3458A DMM readings.
+
+Each reading is returned in a single bus transaction: *END ALWAYS* makes the DMM assert EOI with the last byte of every reading, so a read ends at the terminator instead of being assembled one byte at a time.
+A read that times out clears the interface and triggers again, up to *retries* times.
+
+Several readings can be taken in one burst into the DMM's reading memory and returned with a single *RMEM* transfer.
+The burst is set up once (*MEM LIFO*, *NRDGS*), in *configure* or when the count changes, so each burst is only a trigger and the *RMEM* query; in LIFO mode reading 1 is always the newest, so the memory never needs clearing.
+While a burst is set up *sample* returns the newest reading of a burst and *settle* compares every reading of each burst.
+*acquire* summarises a burst as the mean, standard deviation, minimum, maximum and drift (change over the burst from a straight line fit).
+
+*settle* waits for the reading to stop changing after the source is switched on: it takes fast readings at a short integration time until *stable* successive readings agree within *tolerance* (relative) or *absolute* volts, or *timeout* seconds pass, then restores the measurement integration time.
+'''
+import time
+import numpy
+import pyvisa
+
+
+def statistics(readings):
+    #summary of a burst of readings
+    readings = numpy.asarray(readings,dtype=float)
+    n = readings.size
+    if n>1:
+        std = readings.std(ddof=1)
+        drift = numpy.polyfit(numpy.arange(n),readings,1)[0]*(n-1)
+    else:
+        std = drift = 0.0
+    return {'mean':readings.mean(),'std':std,'min':readings.min(),'max':readings.max(),'drift':drift,'samples':n}
+
+
+class DMM:
+    '''
+    3458A digital multimeter on a pyvisa resource
+    '''
+    def __init__(self,resource,retries=3,timeout=5000):
+        self.dmm = resource
+        self.dmm.read_termination = '\r\n'
+        self.dmm.write_termination = '\r\n' # taken from manual could also use "EX"
+        self.dmm.timeout = timeout#ms
+        self.retries = retries
+        self.nplc = None#measurement integration time, restored after settle
+        self.count = 1#readings per trigger, more than one are stored in reading memory
+
+    def configure(self,function='DCV 10',nplc=1,count=1):
+        self.dmm.write("PRESET NORM") # trying to stop any subprograms that are sending voltages
+        self.dmm.write("TRIG HOLD")# Disable readings
+        self.dmm.write("END ALWAYS")# EOI with every reading so a read stops at the terminator
+        self.dmm.write(function) # 100nV resolution DCV 1 10nv resolution
+        self.dmm.write("NPLC {}".format(nplc))
+        self.nplc = nplc
+        self.dmm.write("TRIG SGL")# Trigger once then return to HOLD state
+        self.dmm.read()# discard the reading from the configuration trigger
+        self.count = 1
+        self.burst(count)
+
+    def burst(self,count):
+        #readings taken by each trigger, stored in reading memory when more than one
+        if count==self.count:
+            return
+        if count>1:
+            self.dmm.write("MEM LIFO")
+            self.dmm.write("NRDGS {},AUTO".format(count))
+        else:
+            self.dmm.write("NRDGS 1,AUTO")
+            self.dmm.write("MEM OFF")
+        self.count = count
+
+    def _query(self,trigger):
+        #send the trigger and read the whole response, retrying after a timeout
+        for attempt in range(self.retries+1):
+            try:
+                self.dmm.write(trigger)
+                return self.dmm.read()
+            except pyvisa.errors.VisaIOError:
+                if attempt==self.retries:
+                    raise
+                self.dmm.clear()# device clear, abandons the partial response
+
+    def sample(self):
+        #trigger one reading, or a burst, and return the (newest) reading as a float
+        if self.count==1:
+            return float(self._query("TRIG SGL"))
+        return self.samples(self.count)[-1]
+
+    def samples(self,count):
+        #trigger count readings into reading memory and return them all, oldest first, from one transfer
+        self.burst(count)
+        if count==1:
+            return [float(self._query("TRIG SGL"))]
+        self.dmm.write("TRIG SGL")
+        response = self._query("RMEM 1,{}".format(count))
+        readings = [float(value) for value in response.replace(';',',').split(',') if value.strip()]
+        return readings[::-1]#newest first in LIFO memory
+
+    def acquire(self,count=1):
+        #statistics of count readings taken in one burst
+        return statistics(self.samples(count))
+
+    def settle(self,tolerance=1e-4,absolute=1e-6,nplc=0.1,stable=2,timeout=2.0):
+        #fast readings until successive values converge, returns (seconds waited, True if settled)
+        self.dmm.write("NPLC {}".format(nplc))
+        start = time.time()
+        last = None
+        agreed = 0
+        while agreed<stable and time.time()-start<timeout:
+            for value in self.samples(self.count):#every reading of a burst is compared
+                if last is not None and abs(value-last)<=max(tolerance*abs(value),absolute):
+                    agreed += 1
+                else:
+                    agreed = 0
+                last = value
+        self.dmm.write("NPLC {}".format(self.nplc))
+        return time.time()-start,agreed>=stable
@@ -0,0 +1,76 @@
+'''
+Run journal for resuming an interrupted measurement run.
+
+Every measured (structure, configuration) pair is recorded in the journal, and a structure is marked complete with the configuration *\**.
+Structures are identified by their row label in the coordinate file, so the journal stays valid whatever the route or offset used to resume.
+The first line records the run (e.g. wafer and die) and a journal from a different run is refused.
+
+Entries are held back and written together at a sync, at most every *interval* seconds and when the journal is closed.
+A sync first calls *flush*, which should make the results written so far durable, then writes and fsyncs the journal, so the journal never lists a measurement whose result could be lost.
+After a hard crash at most *interval* seconds of measurements are repeated.
+'''
+import os
+import time
+
+
+def read_journal(filename):
+    #header and set of (structure,config) pairs recorded, an unfinished last line is ignored
+    header = None
+    completed = set()
+    if not os.path.isfile(filename):
+        return header,completed
+    with open(filename) as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            if line.startswith('#'):
+                header = line[1:].strip()
+                continue
+            structure,_,config = line.rstrip('\n').partition(',')
+            if config:
+                completed.add((structure,config))
+    return header,completed
+
+
+class Journal:
+    '''
+    durable record of the measurements completed in a run
+    '''
+    def __init__(self,filename,header='',resume=False,flush=None,interval=10.0):
+        self.filename = filename
+        self.flush = flush#called before every sync, e.g. pipeline.Pipeline.sync
+        self.interval = interval#s between syncs
+        self.completed = set()
+        if resume:
+            existing,self.completed = read_journal(filename)
+            if existing is not None and existing!=header:
+                raise ValueError('journal {} is for "{}", not "{}"'.format(filename,existing,header))
+        new = not resume or not os.path.isfile(filename)
+        self.f = open(filename,'w' if new else 'a')
+        self.pending = ['# {}\n'.format(header)] if new else []
+        self.last_sync = time.time()
+
+    def done(self,structure,config='*'):
+        #True if the configuration, or with the default the whole structure, has been measured
+        return (str(structure),config) in self.completed
+
+    def record(self,structure,config='*'):
+        #record a measured configuration, or with the default the completed structure
+        self.completed.add((str(structure),config))
+        self.pending.append('{},{}\n'.format(structure,config))
+        if time.time()-self.last_sync>=self.interval:
+            self.sync()
+
+    def sync(self):
+        if self.pending:
+            if self.flush is not None:
+                self.flush()
+            self.f.write(''.join(self.pending))
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.pending = []
+        self.last_sync = time.time()
+
+    def close(self):
+        self.sync()
+        self.f.close()
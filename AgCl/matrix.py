@@ -0,0 +1,81 @@
+'''
+Switching matrix relay state.
+
+The matrix object remembers which pin is connected to which port so a new configuration only switches the relays that differ from the current state:
+
+* nothing is sent if the configuration is already set up
+* only the missing connections are closed (*PC{port}ON{pin}*) if nothing has to be opened
+* otherwise the matrix is cleared (*CL*) and the configuration connected again, or, with an *open_format*, the connections that are no longer needed are opened and the relays shared with the previous configuration stay closed
+* the commands of one update are sent in a single write, joined by *separator* (None writes every command on its own)
+
+The single relay open command is not recorded for this matrix, so *open_format* is None by default.
+To enable it set e.g. *open_format='PC{port}OF{pin:02d}'* once the command has been checked against the 4085M GPIB reference.
+
+Each pin can only be connected to one port, ports can be connected to several pins.
+'''
+
+
+class Matrix:
+    '''
+    4084B switching matrix with tracked relay state
+    '''
+    def __init__(self,resource,open_format=None,separator=';'):
+        self.resource = resource
+        self.connect_format = 'PC{port}ON{pin:02d}'
+        self.open_format = open_format#open one relay e.g. 'PC{port}OF{pin:02d}', None clears the matrix instead
+        self.separator = separator#join the commands of one update into a single write, None sends each on its own
+        self.state = None#pin -> port, None until the matrix has been cleared
+        self.target = {}
+        self.writes = 0#GPIB writes, for checking the saving
+        self.commands = 0#commands sent
+        self.switched = 0#relays operated
+
+    def send(self,commands):
+        if not commands:
+            return
+        if self.separator is None:
+            for cmd in commands:
+                self.resource.write(cmd)
+            self.writes += len(commands)
+        else:
+            self.resource.write(self.separator.join(commands))
+            self.writes += 1
+        self.commands += len(commands)
+
+    def clear(self):
+        self.send(['CL'])
+        self.switched += len(self.state) if self.state else 0
+        self.state = {}
+
+    def begin(self):
+        #start describing the next configuration
+        self.target = {}
+
+    def connect(self,port,pin):
+        #add a connection to the configuration being described
+        self.target[pin] = port
+
+    def commit(self):
+        #switch the matrix from its current state to the described configuration
+        commands = []
+        state = self.state
+        opens = [] if state is None else [(port,pin) for pin,port in state.items() if self.target.get(pin)!=port]
+        if state is None or (opens and self.open_format is None):
+            #unknown state, or no open command: clear in the same write
+            commands.append('CL')
+            self.switched += len(state) if state else 0
+            state = {}
+            opens = []
+        closes = [(port,pin) for pin,port in self.target.items() if state.get(pin)!=port]
+        commands += [self.open_format.format(port=port,pin=pin) for port,pin in opens]#opened first, a pin may only connect to one port
+        commands += [self.connect_format.format(port=port,pin=pin) for port,pin in closes]
+        self.send(commands)
+        self.switched += len(opens)+len(closes)
+        self.state = dict(self.target)
+
+    def set(self,connections):
+        #switch to a configuration given as ((port,pin),...)
+        self.begin()
+        for port,pin in connections:
+            self.connect(port,pin)
+        self.commit()
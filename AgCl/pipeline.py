@@ -0,0 +1,114 @@
+'''
+Measurement sequencing around the probebench, SMU and results file.
+
+The instruments share one GPIB bus so commands are never sent concurrently; instead the steps that do not depend on each other are overlapped with the time the hardware spends working:
+
+* the switching matrix is set up for the next structure's first configuration while the stage is moving
+* results are written to the output file by a worker thread (results.ResultSink)
+
+The safety ordering is enforced here rather than left to each call site:
+
+* the chuck is separated before every move; with *step_distance* a move of at most that length (e.g. to the neighbouring structure in a block) only lowers the chuck to align height, and longer moves and moves to another die separate fully
+* the SMU is disconnected (*DZ1*) before any relay is switched and before every move
+
+Each step is timed into a timing.PhaseTimer (translate, switching, switching_moving for the setup overlapped with motion, contact, separate, align, disconnect, force, write, flush); the probebench adds its own command_delay, position and arrival phases, so phases can nest.
+'''
+import math
+from timing import PhaseTimer
+
+
+class Pipeline:
+    '''
+    runs the measurement steps in the safe order, overlapping matrix setup with stage motion
+    '''
+    def __init__(self,pb,smu,matrix,results=None,fixed_wait=False,overlap=True,step_distance=None,timer=None):
+        self.pb = pb
+        self.smu = smu
+        self.matrix = matrix#matrix.Matrix
+        self.writer = results#results.ResultSink, None when nothing is saved
+        self.fixed_wait = fixed_wait
+        self.overlap = overlap#set up the next configuration during the move
+        self.step_distance = step_distance#um, longest move made at align height, None separates before every move
+        self.timer = PhaseTimer() if timer is None else timer
+        self.contacted = True#unknown at start, so separate before the first move
+        self.height = None#chuck height after the last z command: contact, align or separation
+        self.die = None#die of the last move
+        self.smu_on = True
+
+    def separate(self,align=False):
+        #lower the chuck to separation height, or with align only to align height
+        if self.contacted or (not align and self.height!='separation'):
+            with self.timer.phase('align' if align else 'separate'):
+                if align:
+                    self.pb.chuckAlign()
+                else:
+                    self.pb.chuckSeparation()
+            self.height = 'align' if align else 'separation'
+            self.contacted = False
+
+    def contact(self):
+        self.disconnect()
+        with self.timer.phase('contact'):
+            self.pb.chuckContact()
+        self.contacted = True
+        self.height = 'contact'
+
+    def disconnect(self):
+        if self.smu_on:
+            with self.timer.phase('disconnect'):
+                self.smu.write('DZ1')
+            self.smu_on = False
+
+    def force(self,command):
+        #connect the SMU and apply a source command e.g. DI1,0,100E-6,10
+        with self.timer.phase('force'):
+            self.smu.write('CN1')
+            self.smu.write(command)
+        self.smu_on = True
+
+    def configure(self,configuration,phase='switching'):
+        #switch the matrix to a configurations.Configuration with the SMU disconnected, returns the configuration name
+        self.disconnect()
+        with self.timer.phase(phase):
+            self.matrix.set(configuration.connections)
+        return configuration.name
+
+    def move(self,dx,dy,configuration=None,die=None):
+        '''
+        separate, move to the structure and wait for arrival, with configuration set up while the stage travels
+        moves of up to step_distance within the same die are made at align height
+        returns the configuration name, or None if no configuration was given or overlap is off
+        '''
+        distance = math.hypot(dx-self.pb.target[0],dy-self.pb.target[1])
+        same_die = die is None or die==self.die
+        self.separate(align=self.step_distance is not None and self.height is not None and same_die and distance<=self.step_distance)
+        self.die = die
+        self.disconnect()
+        with self.timer.phase('translate'):
+            self.pb.translate(dx,dy)
+        config = None
+        if configuration is not None and self.overlap:
+            config = self.configure(configuration,phase='switching_moving')
+        if self.fixed_wait:
+            self.timer.sleep('arrival',2.5)# wait in seconds to arrive
+        else:
+            self.pb.waitArrival()
+        return config
+
+    def write(self,row):
+        #one result row, a tuple in the field order of the sink
+        if self.writer is not None:
+            with self.timer.phase('write'):
+                self.writer.write(row)
+
+    def sync(self):
+        #make every result written so far durable, see journal.Journal
+        if self.writer is not None:
+            self.writer.flush(sync=True)
+
+    def close(self):
+        self.disconnect()
+        self.separate()
+        if self.writer is not None:
+            with self.timer.phase('flush'):
+                self.writer.close()
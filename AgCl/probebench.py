@@ -0,0 +1,112 @@
+import time
+import numpy
+from timing import PhaseTimer
+
+
+class Probebench:
+    '''
+    class for interacting with the probebench
+    '''
+    def __init__(self,rm,pad=1,timer=None):
+        self.rm = rm#reference to Resource manager
+        self.timer = PhaseTimer() if timer is None else timer#records command_delay, position and arrival times
+        self.pb = self.rm.open_resource('GPIB0::{}::INSTR'.format(pad))
+        self.pb.write_termination = None
+        self.pb.read_termination = '\r\n'
+        self.delay_time = 0.5#minimum time in seconds between commands to prevent the interface crashing
+        self.last_command = 0.0#time the last command was sent
+        #arrival polling, see waitArrival, polls are spaced by delay_time
+        self.settle_timeout = 2.0#seconds allowed for any move to finish
+        self.min_speed = 2000.0#um/s, slowest expected stage speed, adds distance/min_speed to the timeout
+        self.tolerance = 0.5#um, readings closer than this are the same position
+        self.target = numpy.zeros(2)#last translate target relative to HOME
+        self.distance = 0.0#length of the last move
+
+        #initialise chuck
+    def init(self):
+        cmd_init = '33'
+        self.pb.write(cmd_init)
+
+    def delay(self):
+        #wait only for whatever is left of delay_time since the last command
+        remaining = self.delay_time-(time.time()-self.last_command)
+        if remaining>0:
+            self.timer.sleep('command_delay',remaining)
+        self.last_command = time.time()
+
+    def load(self,vacuum_off=False):
+        cmd_load = '3A'
+        self.pb.write(cmd_load)
+
+
+    def position(self):
+        self.delay()
+        cmd_read = '31'
+        keys = ['status','x','y','z','space','command']
+        with self.timer.phase('position'):
+            pos = self.pb.query(cmd_read,delay=0.1)#seems need to allow a delay before read or probebench crashes and requires reset
+        self.last_command = time.time()
+        positions = dict(zip(keys,pos.split(' ')))
+        positions['x'] = float(positions['x'])
+        positions['y'] = float(positions['y'])
+        positions['z'] = float(positions['z'])
+        positions['status'] = int(positions['status'])
+        return positions
+
+
+    def move(self,x,y):
+        self.delay()
+        #implement relative and absolute motion
+        cmd_move = '34 {} {}'.format(x,y)
+        self.pb.write(cmd_move)
+
+    def translate(self,dx,dy):
+        self.delay()
+        cmd = '34 {} {} H'.format(dx,dy)
+        self.pb.write(cmd)
+        target = numpy.array([dx,dy],dtype=float)
+        self.distance = numpy.hypot(*(target-self.target))
+        self.target = target
+
+    def waitArrival(self,distance=None):
+        '''
+        poll the chuck position until the stage has stopped, returns the time waited in seconds
+        the stage has stopped when the status is 0 and two consecutive readings agree; each poll waits for
+        delay_time since the previous command. distance defaults to the length of the last translate
+        '''
+        if distance is None:
+            distance = self.distance
+        timeout = self.settle_timeout+distance/self.min_speed
+        start = time.time()
+        last = None
+        while True:
+            pos = self.position()
+            current = numpy.array([pos['x'],pos['y']])
+            if pos['status']==0 and last is not None and numpy.all(numpy.abs(current-last)<=self.tolerance):
+                self.timer.record('arrival',time.time()-start)
+                return time.time()-start
+            last = current
+            if time.time()-start>timeout:
+                raise RuntimeError('probebench did not arrive within {:.1f} s (status {})'.format(timeout,pos['status']))
+
+    def moveHome(self):
+        self.delay()
+        cmd = '40'
+        self.pb.write(cmd)
+        self.distance = numpy.hypot(*self.target)
+        self.target = numpy.zeros(2)
+
+    def chuckContact(self):
+        self.delay()
+        cmd = '37'
+        self.pb.write(cmd)
+
+    def chuckSeparation(self):
+        self.delay()
+        cmd = '39'
+        self.pb.write(cmd)
+
+    def chuckAlign(self):
+        self.delay()
+        cmd = '38'
+        self.pb.write(cmd)
@@ -0,0 +1,135 @@
+'''
+Measurement results buffered in typed arrays and written in batches.
+
+Rows are stored in a NumPy structured array with one typed field per column (*result_dtype*) instead of being formatted one line at a time.
+When *batch* rows have been collected the batch is handed to a worker thread which appends it to the CSV file and, optionally, to a columnar file, so the measurement loop only copies a few numbers per configuration.
+
+The columnar format is chosen from the extension, as in *coordinates.py*:
+
+* .npy     - NumPy structured array; batches are appended to *<file>.part* and the .npy is assembled when the sink is closed
+* .parquet - one row group per batch (requires pyarrow)
+
+Either loads directly with *coordinates.load_coordinates*, the .npy memory-mapped.
+The CSV file remains the primary record, a columnar file is only complete once the sink has been closed.
+
+Columns: index, wafer, die, block, material, structure, config, current (A), voltage (V), resistance (ohm), optionally the burst statistics samples, std, min, max, drift (V), the settle time (s) after the current was forced and the timestamp (s since the epoch) of the sample.
+'''
+import os
+import queue
+import threading
+import numpy
+
+
+def result_dtype(material=16,structure=16,config=24,statistics=False):
+    #structured dtype of one result row, text fields are fixed width unicode
+    fields = [('index','i4'),('wafer','i4'),('die','i4'),('block','i4'),
+              ('material','U{}'.format(material)),('structure','U{}'.format(structure)),('config','U{}'.format(config)),
+              ('current','f8'),('voltage','f8'),('resistance','f8')]
+    if statistics:
+        fields += [('samples','i4'),('std','f8'),('min','f8'),('max','f8'),('drift','f8')]
+    fields += [('settle','f8'),('timestamp','f8')]
+    return numpy.dtype(fields)
+
+
+class ResultSink:
+    '''
+    collect result rows and write them in batches from a worker thread
+    '''
+    def __init__(self,f,dtype,columnar=None,batch=64,header=True):
+        self.f = f#open text file for the CSV rows
+        self.dtype = dtype
+        self.batch = batch
+        self.rows = numpy.zeros(batch,dtype=dtype)
+        self.count = 0
+        self.written = 0#rows handed to the worker
+        self.columnar = columnar
+        self.part = None
+        self.parquet = None
+        self.existing = None
+        if columnar is not None:
+            self._open_columnar(append=not header)
+        if header:
+            self.f.write(','.join(dtype.names)+'\n')
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+
+    def _open_columnar(self,append):
+        extension = os.path.splitext(self.columnar)[1].lower()
+        if extension=='.npy':
+            part = self.columnar+'.part'
+            if append and not os.path.isfile(part) and os.path.isfile(self.columnar):
+                numpy.load(self.columnar).astype(self.dtype).tofile(part)#continue from the assembled file
+            self.part = open(part,'ab' if append else 'wb')
+        elif extension=='.parquet':
+            import pyarrow
+            import pyarrow.parquet
+            if append and os.path.isfile(self.columnar):
+                self.existing = pyarrow.parquet.read_table(self.columnar)#rewritten first, a parquet file cannot be appended to
+            self.parquet = pyarrow.parquet.ParquetWriter(self.columnar+'.part',self._arrow_schema())
+            if self.existing is not None:
+                self.parquet.write_table(self.existing.cast(self._arrow_schema()))
+        else:
+            raise ValueError('columnar results must be .npy or .parquet, not {}'.format(self.columnar))
+
+    def _arrow_schema(self):
+        import pyarrow
+        types = {'i':pyarrow.int32(),'f':pyarrow.float64(),'U':pyarrow.string()}
+        return pyarrow.schema([(name,types[self.dtype[name].kind]) for name in self.dtype.names])
+
+    def _run(self):
+        while True:
+            rows = self.queue.get()
+            if rows is None:
+                self.queue.task_done()
+                return
+            self._write(rows)
+            self.queue.task_done()
+
+    def _write(self,rows):
+        text = [','.join(str(value) for value in row)+'\n' for row in rows.tolist()]
+        self.f.write(''.join(text))
+        if self.part is not None:
+            rows.tofile(self.part)
+        if self.parquet is not None:
+            import pyarrow
+            self.parquet.write_table(pyarrow.table({name:rows[name] for name in self.dtype.names},schema=self._arrow_schema()))
+
+    def write(self,row):
+        #add one row, a tuple in dtype field order
+        self.rows[self.count] = row
+        self.count += 1
+        if self.count==self.batch:
+            self._submit()
+
+    def _submit(self):
+        if self.count:
+            self.queue.put(self.rows[:self.count].copy())
+            self.written += self.count
+            self.count = 0
+
+    def flush(self,sync=False):
+        #write everything collected so far, with sync also make it durable
+        self._submit()
+        self.queue.join()
+        self.f.flush()
+        if self.part is not None:
+            self.part.flush()
+        if sync:
+            os.fsync(self.f.fileno())
+            if self.part is not None:
+                os.fsync(self.part.fileno())
+
+    def close(self):
+        self._submit()
+        self.queue.put(None)
+        self.thread.join()
+        self.f.close()
+        if self.part is not None:
+            self.part.close()
+            records = numpy.fromfile(self.columnar+'.part',dtype=self.dtype)
+            numpy.save(self.columnar,records)
+            os.remove(self.columnar+'.part')
+        if self.parquet is not None:
+            self.parquet.close()
+            os.replace(self.columnar+'.part',self.columnar)
@@ -0,0 +1,137 @@
+'''
+Visit order planning for the structures on a wafer or die.
+
+The stage starts over the **HOME** structure and the route is an open path from there through every selected structure.
+Available orderings:
+
+* *file* - the order of the coordinate file (default)
+* *serpentine* - rows of structures, alternating direction on each row, starting from the end row and side nearest the start position
+* *nearest* - nearest neighbour from the start position
+* *2opt* - nearest neighbour improved with 2-opt segment reversal and Or-opt segment moves
+
+Distances are in microns, the same units as the coordinate file.
+'''
+import numpy
+
+
+def route_length(xy,order,start=None):
+    #total stage travel of visiting xy in order, beginning from start if given
+    path = numpy.asarray(xy,dtype=float)[numpy.asarray(order,dtype=int)]
+    if start is not None:
+        path = numpy.vstack([start,path])
+    return numpy.sum(numpy.hypot(*numpy.diff(path,axis=0).T))
+
+def travel_time(xy,order,start=None,speed=10000.0,overhead=0.0):
+    #estimated stage time in seconds, speed in microns per second plus a fixed overhead per move
+    return route_length(xy,order,start)/speed+overhead*len(order)
+
+def serpentine(xy,row_pitch=None,start=None):
+    '''
+    group structures into rows of height row_pitch (default the smallest y step) and sweep alternately left and right
+    with start the sweep begins in the end row and direction, of the four, giving the shortest route from start
+    '''
+    xy = numpy.asarray(xy,dtype=float)
+    if row_pitch is None:
+        steps = numpy.diff(numpy.unique(xy[:,1]))
+        row_pitch = steps.min() if steps.size else 1.0
+    rows = numpy.floor((xy[:,1]-xy[:,1].min())/row_pitch+0.5).astype(int)
+    best = None
+    for sweep in (rows,rows.max()-rows):#bottom row first or top row first
+        for first in (1.0,-1.0):#first row left to right or right to left
+            direction = numpy.where(sweep%2==0,first,-first)
+            order = numpy.lexsort((direction*xy[:,0],sweep))
+            if start is None:
+                return order
+            length = route_length(xy,order,start)
+            if best is None or length<best[0]:
+                best = (length,order)
+    return best[1]
+
+def nearest_neighbour(xy,start=None):
+    #greedy order, each move goes to the closest structure not yet visited
+    xy = numpy.asarray(xy,dtype=float)
+    remaining = numpy.ones(len(xy),dtype=bool)
+    position = xy[0] if start is None else numpy.asarray(start,dtype=float)
+    order = numpy.empty(len(xy),dtype=int)
+    for n in range(len(xy)):
+        distance = numpy.hypot(*(xy-position).T)
+        distance[~remaining] = numpy.inf
+        order[n] = numpy.argmin(distance)
+        remaining[order[n]] = False
+        position = xy[order[n]]
+    return order
+
+def _distance(a,b):
+    #distance between [x,y,...] rows, zero where either is missing (the open end of the path)
+    return numpy.nan_to_num(numpy.hypot(a[...,0]-b[...,0],a[...,1]-b[...,1]))
+
+def _two_opt(path):
+    #reverse segments of the open path while it gets shorter, path rows are [x,y,index] and path[0] stays fixed
+    end = numpy.full((1,path.shape[1]),numpy.nan)
+    improved = False
+    for i in range(len(path)-2):
+        a = path[i]
+        b = path[i+1]
+        c = path[i+2:]#candidate new neighbour of a
+        d = numpy.vstack([path[i+3:],end])#following c
+        gain = _distance(a,b)+_distance(c,d)-_distance(c,a)-_distance(d,b)
+        j = numpy.argmax(gain)
+        if gain[j]>1e-9:
+            path[i+1:i+3+j] = path[i+1:i+3+j][::-1].copy()
+            improved = True
+    return improved
+
+def _or_opt(path,lengths=(1,2,3)):
+    #move short segments, forwards or reversed, to wherever they shorten the open path, path[0] stays fixed
+    end = numpy.full((1,path.shape[1]),numpy.nan)
+    improved = False
+    for length in lengths:
+        i = 1
+        while i+length<=len(path):
+            segment = path[i:i+length]
+            rest = numpy.vstack([path[:i],path[i+length:]])
+            after = path[i+length] if i+length<len(path) else end[0]
+            removed = _distance(path[i-1],segment[0])+_distance(segment[-1],after)-_distance(path[i-1],after)
+            q = rest
+            r = numpy.vstack([rest[1:],end])
+            gap = _distance(q,r)
+            forward = _distance(q,segment[0])+_distance(r,segment[-1])-gap
+            backward = _distance(q,segment[-1])+_distance(r,segment[0])-gap
+            forward[i-1] = backward[i-1] = numpy.inf#back where it came from
+            k = numpy.argmin(numpy.minimum(forward,backward))
+            if removed-min(forward[k],backward[k])>1e-9:
+                moved = segment if forward[k]<=backward[k] else segment[::-1]
+                path[:] = numpy.vstack([rest[:k+1],moved,rest[k+1:]])
+                improved = True
+            else:
+                i += 1
+    return improved
+
+def improve(xy,order,start=None,passes=20):
+    #2-opt and Or-opt passes until no move shortens the route
+    xy = numpy.asarray(xy,dtype=float)
+    order = numpy.asarray(order,dtype=int)
+    origin = xy[order[0]] if start is None else numpy.asarray(start,dtype=float)
+    #the start position is a fixed first row, the index column follows every move
+    path = numpy.column_stack([numpy.vstack([origin,xy[order]]),numpy.concatenate([[-1],order])])
+    for _ in range(passes):
+        if not (_two_opt(path)|_or_opt(path)):
+            break
+    return path[1:,2].astype(int)
+
+def plan_route(xy,method='file',start=None,passes=20):
+    '''
+    indices of xy in visit order using one of the methods above
+    start is the stage position before the first move, normally the HOME structure
+    '''
+    xy = numpy.asarray(xy,dtype=float)
+    if len(xy)==0 or method=='file':
+        return numpy.arange(len(xy))
+    if method=='serpentine':
+        return serpentine(xy,start=start)
+    order = nearest_neighbour(xy,start)
+    if method=='nearest':
+        return order
+    if method=='2opt':
+        return improve(xy,order,start,passes)
+    raise ValueError('unknown route method {}'.format(method))
@@ -0,0 +1,286 @@
+'''
+Simulated instruments for running the measurement script without the probe station.
+
+*SimulatedResourceManager* stands in for *pyvisa.ResourceManager* and opens simulated instruments at the primary addresses of the bench:
+
+**Address**      **Instrument**
+----------- -------------------
+01          Probebench  (PA200)
+12                    3458A DMM
+22          4084B Switch Matrix
+23                    4142B SMU
+-------------------------------
+
+Every write and read waits *latency* seconds, the bus time of one GPIB transaction.
+The stage moves at *speed* um/s from the position it was at when the move command arrived, so arrival polling sees it travelling.
+DMM readings take *nplc* power line cycles and return the SMU current times *resistance* plus gaussian *noise* volts, formatted as the 3458A does.
+After the current is forced the voltage approaches its final value exponentially with time constant *settle* seconds.
+A read with nothing to return raises the same timeout error as pyvisa.
+
+*check_matrix* switches a simulated matrix through every transition between compiled configurations and checks the relays match each configuration and that fewer writes are sent than clearing and reconnecting every configuration.
+'''
+import re
+import time
+import numpy
+import pyvisa
+
+
+class SimulatedInstrument:
+    '''
+    pyvisa message based resource with a fixed latency per transaction
+    '''
+    def __init__(self,name,latency=0.0):
+        self.resource_name = name
+        self.latency = latency#s per write or read
+        self.read_termination = None
+        self.write_termination = None
+        self.timeout = 2000#ms
+        self.pending = []#responses waiting to be read
+        self.commands = []#every command received, for checking a run
+        self.writes = 0
+        self.reads = 0
+
+    def write(self,message):
+        time.sleep(self.latency)
+        self.writes += 1
+        self.commands.append(message)
+        self.respond(message)
+
+    def respond(self,message):
+        #handle a command, instruments add any response to pending
+        pass
+
+    def _timeout(self):
+        time.sleep(self.timeout/1000.0)
+        raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+
+    def read(self):
+        time.sleep(self.latency)
+        self.reads += 1
+        if self.pending:
+            message = self.pending.pop(0)
+        else:
+            self._timeout()
+        return message
+
+    def query(self,message,delay=None):
+        self.write(message)
+        if delay:
+            time.sleep(delay)
+        return self.read()
+
+    def clear(self):
+        time.sleep(self.latency)
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+class SimulatedProbebench(SimulatedInstrument):
+    '''
+    PA200 chuck: home relative moves, position read back and chuck heights
+    '''
+    def __init__(self,name,latency=0.0,speed=10000.0):
+        super().__init__(name,latency)
+        self.speed = speed#um/s
+        self.start = numpy.zeros(2)#position when the last move began
+        self.end = numpy.zeros(2)
+        self.move_time = 0.0
+        self.heights = {'37':0.0,'38':-20.0,'39':-100.0}#contact, align, separation um
+        self.z = self.heights['39']
+        self.moves = 0
+        self.travel = 0.0#um
+
+    def xy(self):
+        #position now, part way along the last move if it has not finished
+        distance = numpy.hypot(*(self.end-self.start))
+        if distance==0:
+            return self.end
+        fraction = min((time.time()-self.move_time)*self.speed/distance,1.0)
+        return self.start+(self.end-self.start)*fraction
+
+    def goto(self,target):
+        self.start = self.xy()
+        self.end = numpy.array(target,dtype=float)
+        self.move_time = time.time()
+        self.moves += 1
+        self.travel += numpy.hypot(*(self.end-self.start))
+
+    def respond(self,message):
+        fields = message.split()
+        cmd = fields[0]
+        if cmd=='34':
+            self.goto((float(fields[1]),float(fields[2])))
+        elif cmd=='40':
+            self.goto((0.0,0.0))
+        elif cmd in self.heights:
+            self.z = self.heights[cmd]
+        elif cmd=='31':
+            x,y = self.xy()
+            self.pending.append('0 {:.1f} {:.1f} {:.1f} H 31'.format(x,y,self.z))
+
+
+class SimulatedMatrix(SimulatedInstrument):
+    '''
+    4084B switching matrix, keeps the connected (port,pin) pairs
+    '''
+    def __init__(self,name,latency=0.0):
+        super().__init__(name,latency)
+        self.connections = set()
+
+    def respond(self,message):
+        #several commands may be joined in one write, see matrix.Matrix separator
+        for cmd,port,state,pin in re.findall(r'(CL|PC(\d+)(ON|OF)(\d+))',message):
+            if cmd=='CL':
+                self.connections = set()
+            elif state=='ON':
+                if any(p==int(pin) and q!=int(port) for q,p in self.connections):
+                    raise ValueError('pin {} is already connected to another port'.format(pin))
+                self.connections.add((int(port),int(pin)))
+            else:
+                self.connections.discard((int(port),int(pin)))
+
+
+class SimulatedSMU(SimulatedInstrument):
+    '''
+    4142B source monitor unit, only the forced current of channel 1 is modelled
+    '''
+    def __init__(self,name,latency=0.0):
+        super().__init__(name,latency)
+        self.connected = False
+        self.current = 0.0#A, forced while connected
+        self.forced = 0.0#time the current was last set
+        self.settle = 0.0#s time constant of the response
+
+    def respond(self,message):
+        if message.startswith('CN'):
+            self.connected = True
+        elif message.startswith('DZ') or message.startswith('CL'):
+            self.connected = False
+            self.current = 0.0
+        elif message.startswith('DI'):
+            self.current = float(message[2:].split(',')[2])
+            self.forced = time.time()
+
+    def output(self):
+        if not self.connected:
+            return 0.0
+        if self.settle<=0:
+            return self.current
+        return self.current*(1.0-numpy.exp(-(time.time()-self.forced)/self.settle))
+
+
+class SimulatedDMM(SimulatedInstrument):
+    '''
+    3458A voltmeter measuring the simulated SMU current through a resistance
+    '''
+    def __init__(self,name,smu,latency=0.0,resistance=100.0,noise=1e-6,line_frequency=50.0,seed=None):
+        super().__init__(name,latency)
+        self.smu = smu
+        self.resistance = resistance#ohm
+        self.noise = noise#V standard deviation
+        self.line_frequency = line_frequency
+        self.random = numpy.random.default_rng(seed)
+        self.nplc = 10.0
+        self.nrdgs = 1
+        self.memory = None#reading memory mode, FIFO or LIFO
+        self.capacity = 10240#readings held, LIFO drops the oldest
+        self.stored = []
+
+    def reading(self):
+        time.sleep(self.nplc/self.line_frequency)
+        value = self.smu.output()*self.resistance+self.random.normal(0.0,self.noise)
+        return '{:+.8E}'.format(value)
+
+    def respond(self,message):
+        cmd = message.split()
+        if not cmd:
+            return
+        if cmd[0]=='NPLC':
+            self.nplc = float(cmd[1])
+        elif cmd[0]=='NRDGS':
+            self.nrdgs = int(cmd[1].split(',')[0])
+        elif cmd[0]=='MEM':
+            self.memory = None if cmd[1]=='OFF' else cmd[1]
+            self.stored = []
+        elif cmd[0]=='PRESET':
+            self.nplc,self.nrdgs,self.memory = 10.0,1,None
+        elif message=='TRIG SGL':
+            readings = [self.reading() for n in range(self.nrdgs)]
+            if self.memory=='LIFO':
+                self.stored = (readings[::-1]+self.stored)[:self.capacity]#reading 1 is the newest
+            elif self.memory is not None:
+                self.stored += readings
+            else:
+                self.pending.append(','.join(readings))
+        elif cmd[0]=='RMEM':
+            first,count = [int(v) for v in cmd[1].split(',')]
+            self.pending.append(','.join(self.stored[first-1:first-1+count]))
+
+
+class SimulatedResourceManager:
+    '''
+    stands in for pyvisa.ResourceManager, opens the simulated instruments by primary address
+    '''
+    def __init__(self,latency=0.0,speed=10000.0,resistance=100.0,noise=1e-6,settle=0.01,seed=None):
+        self.latency = latency
+        self.settle = settle
+        self.speed = speed
+        self.resistance = resistance
+        self.noise = noise
+        self.seed = seed
+        self.instruments = {}#address -> instrument, one per address as on the bus
+
+    def list_resources(self):
+        return tuple('GPIB0::{}::INSTR'.format(address) for address in (1,12,22,23))
+
+    def open_resource(self,name):
+        address = int(name.split('::')[1])
+        if address not in self.instruments:
+            if address==1:
+                instrument = SimulatedProbebench(name,self.latency,self.speed)
+            elif address==12:
+                instrument = SimulatedDMM(name,self.open_resource('GPIB0::23::INSTR'),self.latency,self.resistance,self.noise,seed=self.seed)
+            elif address==22:
+                instrument = SimulatedMatrix(name,self.latency)
+            elif address==23:
+                instrument = SimulatedSMU(name,self.latency)
+                instrument.settle = self.settle
+            else:
+                raise ValueError('no simulated instrument at {}'.format(name))
+            self.instruments[address] = instrument
+        return self.instruments[address]
+
+    def commands(self):
+        #transactions per instrument, for comparing runs
+        return {instrument.resource_name:(instrument.writes,instrument.reads) for instrument in self.instruments.values()}
+
+
+def check_matrix(plans,open_format=None,separator=';'):
+    '''
+    switch a matrix.Matrix on a simulated matrix through every transition between the configurations in plans, lists of configurations.Configuration
+    returns (writes,relays) sent over all transitions and (writes,relays) of clearing and reconnecting, as before the relay state was tracked
+    '''
+    from matrix import Matrix
+    connections = sorted(set(configuration.connections for selected in plans for configuration in selected))
+    simulated = SimulatedMatrix('GPIB0::22::INSTR')
+    relays = Matrix(simulated,open_format=open_format,separator=separator)
+    tracked = [0,0]
+    cleared = [0,0]
+    for a in connections:
+        for b in connections:
+            if a==b:
+                continue
+            relays.set(a)
+            writes,switched = relays.writes,relays.switched
+            relays.set(b)
+            if simulated.connections!=set(b):
+                raise RuntimeError('matrix relays {} do not match {}'.format(sorted(simulated.connections),b))
+            tracked[0] += relays.writes-writes
+            tracked[1] += relays.switched-switched
+            cleared[0] += 1+len(b)
+            cleared[1] += len(a)+len(b)
+    if tracked[0]>=cleared[0]:
+        raise RuntimeError('matrix sent {} writes, clearing and reconnecting needs {}'.format(tracked[0],cleared[0]))
+    return tuple(tracked),tuple(cleared)
@@ -0,0 +1,72 @@
+'''
+Per-phase timing of a measurement run.
+
+Every timed step (stage move, arrival wait, chuck contact, matrix switching, SMU settling, DMM sample, result write, ...) is recorded as one duration against the phase name and the current context (structure index, configuration).
+With a log file each record is also written as a JSON line as it happens, so a run that stops part way still has its timings:
+
+    {"phase": "sample", "seconds": 0.0213, "t": 812.4, "index": 31, "config": "LW300_plus"}
+
+*summary* reports, for every phase, the count, total time and share of the run, p50, p95 and maximum, and histograms of the durations of the phases that take most of the run.
+'''
+import contextlib
+import json
+import time
+import numpy
+
+
+class PhaseTimer:
+    '''
+    collects durations per phase and optionally logs each one
+    '''
+    def __init__(self,log=None):
+        self.log = log#open text file for JSON lines, None keeps the durations in memory only
+        self.durations = {}#phase -> [seconds,...] in the order recorded
+        self.context = {}
+        self.start = time.perf_counter()
+
+    def set(self,**context):
+        #replace the context stored with the following records, e.g. index and config
+        self.context = context
+
+    def record(self,phase,seconds):
+        self.durations.setdefault(phase,[]).append(seconds)
+        if self.log is not None:
+            entry = {'phase':phase,'seconds':round(seconds,6),'t':round(time.perf_counter()-self.start,3)}
+            entry.update(self.context)
+            self.log.write(json.dumps(entry)+'\n')
+
+    @contextlib.contextmanager
+    def phase(self,name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name,time.perf_counter()-start)
+
+    def sleep(self,name,seconds):
+        #a fixed wait, recorded so the report shows how much of the run it takes
+        time.sleep(seconds)
+        self.record(name,seconds)
+
+    def totals(self):
+        return {phase:float(numpy.sum(values)) for phase,values in self.durations.items()}
+
+    def summary(self,bins=10,width=40,share=0.05):
+        #histograms only for the phases taking at least share of the run
+        elapsed = time.perf_counter()-self.start
+        lines = ['{:<16}{:>8}{:>11}{:>7}{:>10}{:>10}{:>10}'.format('phase','count','total s','%','p50 s','p95 s','max s')]
+        order = sorted(self.durations,key=lambda phase:-numpy.sum(self.durations[phase]))
+        for phase in order:
+            values = numpy.asarray(self.durations[phase])
+            p50,p95 = numpy.percentile(values,[50,95])
+            lines.append('{:<16}{:>8}{:>11.1f}{:>7.1f}{:>10.4f}{:>10.4f}{:>10.4f}'.format(phase,values.size,values.sum(),100.0*values.sum()/elapsed,p50,p95,values.max()))
+        lines.append('elapsed {:.1f} s'.format(elapsed))
+        for phase in order:
+            values = numpy.asarray(self.durations[phase])
+            if values.max()==values.min() or values.sum()<share*elapsed:
+                continue
+            counts,edges = numpy.histogram(values,bins=bins)
+            lines.append('\n{} (s)'.format(phase))
+            for count,low,high in zip(counts,edges[:-1],edges[1:]):
+                lines.append('{:>10.4f} - {:<10.4f}{:>6} {}'.format(low,high,count,'#'*int(round(width*count/counts.max()))))
+        return '\n'.join(lines)
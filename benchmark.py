@@ -0,0 +1,151 @@
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import gdstk
+from wafer import Wafer
+from generate_layout import populate,grid_pitch,array_references
+from generate_probe_contacts import probe_card
+from extract_coords import extract
+from coordinates import save_coordinates,load_coordinates
+
+'''
+Throughput benchmarks for layout generation and measurement runs.
+
+Each benchmark is timed *benchmark_repeats* times and the fastest time kept.  Results are printed and appended to *output_file* as one JSON object per line so runs on different commits can be compared:
+
+    {"benchmark": "populate", "parameters": {...}, "seconds": 0.012, "items": 31000, "rate": 2.6e6, "commit": "...", "time": "..."}
+
+*rate* is items per second.  The benchmarks are:
+
+* populate: sites placed per second across wafer sizes and spacings
+* gds: writing the arrayed layout, reading it back with gdstk and extracting the coordinates with gdstk and the streaming reader
+* coordinates: loading the coordinates from csv and npy, and loading and filtering the AgCl coordinate file
+* agcl: AgCl/agcl_example.py run with --simulate (AgCl/simulator.py) for each set of options in *benchmark_agcl_runs*, structures per hour and the total time of each phase from its timing log (arrival, command_delay, contact_wait, switching, settle, sample, ...)
+
+Run all benchmarks, or name some on the command line:
+
+    python benchmark.py populate gds
+'''
+
+root = os.path.dirname(os.path.abspath(__file__))
+output_file = os.path.join(root,'benchmark_results.jsonl')
+benchmark_repeats = 3
+benchmark_wafers = [50.0,100.0,150.0,200.0]#mm
+benchmark_spacings = [100.0,500.0]#um
+benchmark_probecard = dict(rows=2,cols=4,pad_side=120,pitch=240)
+benchmark_gds_wafer = 200.0#mm, layout written and read back
+benchmark_agcl_file = os.path.join(root,'AgCl','AgAgCl_TS_Kelvin_R2_00_03.csv')
+benchmark_agcl_structures = 12#structures visited in the simulated run, the first rows of the coordinate file
+benchmark_agcl_runs = [[],['--samples=4'],['--step=1000','--columnar=npy']]#agcl_example.py options of each simulated run
+
+
+def commit():
+    #git commit of the tree being benchmarked, None outside a repository
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],cwd=root,capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def timed(function,*args,repeats=None,**kwargs):
+    #fastest of repeats calls, returns (seconds,result of the last call)
+    best = None
+    for n in range(benchmark_repeats if repeats is None else repeats):
+        start = time.perf_counter()
+        result = function(*args,**kwargs)
+        elapsed = time.perf_counter()-start
+        best = elapsed if best is None else min(best,elapsed)
+    return best,result
+
+def record(results,benchmark,seconds,items,**parameters):
+    results.append({'benchmark':benchmark,'parameters':parameters,'seconds':seconds,'items':items,'rate':items/seconds if seconds>0 else None})
+    print('{:<12} {:<60} {:>10.4f} s {:>10} items'.format(benchmark,json.dumps(parameters),seconds,items))
+
+def bench_populate(results,workdir):
+    bbox = probe_card(**benchmark_probecard).bounding_box()
+    for diameter in benchmark_wafers:
+        for spacing in benchmark_spacings:
+            seconds,coords = timed(populate,bbox,spacing=spacing,outline=Wafer(diameter,1000.0))
+            record(results,'populate',seconds,coords.shape[0],wafer=diameter,spacing=spacing)
+            seconds,coords = timed(populate,bbox,spacing=spacing,outline=Wafer.semi(diameter,1000.0))
+            record(results,'populate',seconds,coords.shape[0],wafer=diameter,spacing=spacing,flats=True)
+
+def bench_gds(results,workdir):
+    cell = probe_card(**benchmark_probecard)
+    bbox = cell.bounding_box()
+    spacing = min(benchmark_spacings)
+    coords = populate(bbox,spacing=spacing,outline=Wafer(benchmark_gds_wafer,1000.0))
+    filename = os.path.join(workdir,'layout.gds')
+
+    def write():
+        lib = gdstk.Library()
+        top = lib.new_cell('Top')
+        lib.add(cell)
+        top.add(*array_references(cell,coords,grid_pitch(bbox,spacing=spacing)))
+        lib.write_gds(filename)
+    seconds,_ = timed(write)
+    record(results,'gds',seconds,coords.shape[0],step='write',wafer=benchmark_gds_wafer,spacing=spacing)
+    seconds,_ = timed(gdstk.read_gds,filename)
+    record(results,'gds',seconds,coords.shape[0],step='read',wafer=benchmark_gds_wafer,spacing=spacing)
+    for stream in (False,True):
+        seconds,extracted = timed(extract,filename,cell.name,stream=stream)
+        record(results,'gds',seconds,extracted.shape[0],step='extract',stream=stream,wafer=benchmark_gds_wafer,spacing=spacing)
+
+def bench_coordinates(results,workdir):
+    coords = populate(probe_card(**benchmark_probecard).bounding_box(),spacing=min(benchmark_spacings),outline=Wafer(benchmark_gds_wafer,1000.0))
+    for extension in ('.csv','.npy'):
+        filename = os.path.join(workdir,'coords'+extension)
+        save_coordinates(filename,coords)
+        seconds,table = timed(load_coordinates,filename)
+        record(results,'coordinates',seconds,len(table),step='load',format=extension[1:])
+    seconds,table = timed(load_coordinates,benchmark_agcl_file)
+    record(results,'coordinates',seconds,len(table),step='load',file=os.path.basename(benchmark_agcl_file))
+    seconds,subset = timed(table.query,'structure == "LW300" and material == "Pt"')
+    record(results,'coordinates',seconds,len(subset),step='filter',file=os.path.basename(benchmark_agcl_file))
+
+def bench_agcl(results,workdir):
+    #agcl_example.py itself against the simulated instruments, timed from the phases in its timing log
+    script = os.path.join(root,'AgCl','agcl_example.py')
+    for options in benchmark_agcl_runs:
+        output = os.path.join(workdir,'agcl.csv')
+        timing = os.path.join(workdir,'agcl_timing.jsonl')
+        command = [sys.executable,script,'--simulate','--measure','--wafer=0','--die=0','--coordinates='+benchmark_agcl_file,
+                   '--output='+output,'--output-overwrite','--timing-log='+timing,
+                   '--filter','--filter-string=index < {}'.format(benchmark_agcl_structures)]+options
+        env = dict(os.environ,PYTHONPATH=os.pathsep.join(filter(None,[root,os.environ.get('PYTHONPATH')])))#coordinates.py is imported from the repository root
+        run = subprocess.run(command,cwd=workdir,env=env,capture_output=True,text=True)
+        if run.returncode!=0 or not os.path.isfile(timing):
+            print('ERROR: agcl_example.py {} failed\n{}'.format(' '.join(options),run.stdout[-2000:]+run.stderr[-2000:]))
+            continue
+        phases = {}
+        with open(timing) as f:
+            for line in f:
+                entry = json.loads(line)
+                phases.setdefault(entry['phase'],[]).append(entry['seconds'])
+        structures = phases.get('structure',[])
+        seconds = sum(structures)
+        record(results,'agcl',seconds,len(structures),options=options,measurements=len(phases.get('sample',[])),
+               structures_per_hour=round(len(structures)*3600.0/seconds,1) if seconds>0 else None,
+               phases={phase:round(sum(values),3) for phase,values in phases.items() if phase!='structure'})
+
+benchmarks = {'populate':bench_populate,'gds':bench_gds,'coordinates':bench_coordinates,'agcl':bench_agcl}
+
+if __name__ == '__main__':
+    selected = sys.argv[1:] or list(benchmarks)
+    for name in selected:
+        if name not in benchmarks:
+            print('ERROR: unknown benchmark {}, choose from {}'.format(name,', '.join(benchmarks)))
+            exit()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in selected:
+            benchmarks[name](results,workdir)
+    info = {'commit':commit(),'time':datetime.datetime.now().isoformat(timespec='seconds'),'python':platform.python_version(),'machine':platform.node()}
+    with open(output_file,'a') as f:
+        for result in results:
+            f.write(json.dumps(dict(result,**info))+'\n')
+    print('{} results appended to {}'.format(len(results),output_file))
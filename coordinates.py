@@ -0,0 +1,96 @@
+#!/usr/bin/python
+import io
+import os
+import sys
+import tokenize
+import numpy as np
+import pandas as pd
+
+'''
+Reading and writing structure coordinate tables.
+
+The format is chosen from the file extension:
+
+* .csv     - text, as written by np.savetxt or pandas (the '# x,y' header of np.savetxt files is understood)
+* .npy     - NumPy structured array, one field per column, loaded memory-mapped so opening a large map is near-instant
+* .parquet - columnar, written and read through pandas (requires pyarrow or fastparquet)
+
+With *as_frame=False* a .npy table stays memory-mapped; *select_coordinates* then reads only the columns named in a query and copies only the matching rows into a DataFrame.
+
+Convert an existing file with:
+
+~~~~
+python coordinates.py AgAgCl_TS_Kelvin_R2_00_03.csv AgAgCl_TS_Kelvin_R2_00_03.npy
+~~~~
+'''
+
+def to_records(table):
+    #structured array from an [n,2] x,y array, DataFrame or structured array; text columns become fixed width
+    if isinstance(table,np.ndarray) and table.dtype.names is not None:
+        return table
+    if not isinstance(table,pd.DataFrame):
+        table = pd.DataFrame(np.asarray(table,dtype=float).reshape(-1,2),columns=['x','y'])
+    fields = []
+    for name in table.columns:
+        column = table[name]
+        if column.dtype.kind in 'biuf':
+            fields.append((str(name),column.dtype))
+        else:
+            width = max(1,int(column.astype(str).str.len().max())) if len(column) else 1
+            fields.append((str(name),'U{}'.format(width)))
+    records = np.empty(len(table),dtype=fields)
+    for name,_ in fields:
+        records[name] = table[name].to_numpy()
+    return records
+
+def save_coordinates(filename,table):
+    #write coordinates, table is an [n,2] x,y array, a DataFrame or a structured array
+    extension = os.path.splitext(filename)[1].lower()
+    if extension=='.npy':
+        np.save(filename,to_records(table))
+    elif extension=='.parquet':
+        pd.DataFrame(to_records(table)).to_parquet(filename,index=False)
+    elif isinstance(table,pd.DataFrame):
+        table.to_csv(filename,index=False)
+    elif isinstance(table,np.ndarray) and table.dtype.names is not None:
+        pd.DataFrame(table).to_csv(filename,index=False)
+    else:
+        np.savetxt(filename,table,delimiter=',',header='x,y')
+
+def load_coordinates(filename,as_frame=True,mmap=True,**kwargs):
+    '''
+    read a coordinate table as a DataFrame, or as a structured array with as_frame=False
+    .npy files are memory-mapped unless mmap is False, kwargs are passed to pandas.read_csv
+    '''
+    extension = os.path.splitext(filename)[1].lower()
+    if extension=='.npy':
+        records = np.load(filename,mmap_mode='r' if mmap else None)
+        return pd.DataFrame(records) if as_frame else records
+    if extension=='.parquet':
+        frame = pd.read_parquet(filename)
+    else:
+        with open(filename,'r') as f:
+            first = f.readline()
+        if first.startswith('#') and 'names' not in kwargs:#np.savetxt header
+            kwargs.update(names=[name.strip() for name in first[1:].split(',')],skiprows=1)
+        frame = pd.read_csv(filename,**kwargs)
+    return frame if as_frame else to_records(frame)
+
+def select_coordinates(records,expression=None):
+    '''
+    DataFrame of the rows of a structured array matching a pandas query expression, indexed by row number
+    only the columns named in the expression are read to evaluate it, so a memory-mapped table is not loaded in full
+    '''
+    if expression is None:
+        rows = np.arange(len(records))
+    else:
+        names = {token.string for token in tokenize.generate_tokens(io.StringIO(expression).readline) if token.type==tokenize.NAME}
+        columns = pd.DataFrame({name:records[name] for name in records.dtype.names if name in names},index=pd.RangeIndex(len(records)))
+        rows = columns.query(expression).index.to_numpy()
+    return pd.DataFrame(records[rows],index=rows)
+
+if __name__ == '__main__':
+    if len(sys.argv)!=3:
+        print('usage: coordinates.py input output')
+        exit()
+    save_coordinates(sys.argv[2],load_coordinates(sys.argv[1]))
@@ -156,9 +156,11 @@ dmm.write_termination = '\r\n'#taken from manual could also use "EX"
 
 dmm.write("PRESET NORM")#trying to stop any subprograms that are sending voltages
 dmm.write("TRIG HOLD")
+dmm.write("END ALWAYS")#EOI with every reading so a read stops at the terminator
 dmm.write("DCV 10")
 dmm.write("NPLC 1")
 dmm.write("TRIG SGL")
+dmm.read()#discard the reading from the configuration trigger
 
 #contact A = 17
 #contact B = 14
@@ -194,13 +196,15 @@ def clear_matrix():
     matrix.write(cmd)
 
 def sample():
+    #whole reading in one transfer, retried after a device clear if the read times out
+    for attempt in range(3):
+        try:
+            dmm.write("TRIG SGL")
+            return dmm.read()
+        except pyvisa.errors.VisaIOError:
+            dmm.clear()
     dmm.write("TRIG SGL")
-    message = ''
-    byte = ''
-    while byte != '\r':
-        message += byte
-        byte = dmm.read_bytes(1)
-    return message
+    return dmm.read()
 #select an appropriate constant current for greek cross
 #anticipate an expected potential for greek crossbridge
 
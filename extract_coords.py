@@ -1,13 +1,175 @@
+import os
+import struct
 import numpy as np
 import gdstk
+from coordinates import save_coordinates
+
+'''
+Extract the absolute coordinates of every instance of a cell from a GDSII layout.
+
+References are followed through the whole hierarchy, including arrayed references (AREF) and the rotation, magnification and x-reflection of each reference, starting from every top level cell.
+The placement of the target cell inside each parent is computed once and reused for every instance of that parent.
+
+Two readers are available: the gdstk library reader (geometry is skipped) and a streaming reader that walks the GDSII records and keeps only the reference records, so very large full-reticle files never need to be loaded as a library.
+'''
 
 input_file = 'layout.gds'
 input_cell = 'probes_4x2_240um'
 output_file = 'layout_coords_extracted.csv'
-lib = gdstk.read_gds(input_file)
-top = lib.top_level()
-cell = top[0]
-refs = cell.references
-coords = np.array([ref.origin for ref in refs])
-np.savetxt(output_file,coords,delimiter=',',header='x,y')
-print('extracted {} coordinates'.format(coords.shape[0]))
+stream = False#use the streaming reader instead of gdstk
+output_binary = False#also write the coordinates as a memory-mappable .npy beside the csv
+
+
+def _transform(points,origin,rotation=0.0,magnification=1.0,x_reflection=False,offsets=None):
+    #place points from a referenced cell into the parent, once for each repetition offset
+    points = np.asarray(points,dtype=float).reshape(-1,2)
+    if x_reflection:
+        points = points*[1.0,-1.0]
+    c,s = np.cos(rotation)*magnification,np.sin(rotation)*magnification
+    placed = points@np.array([[c,s],[-s,c]])+origin
+    if offsets is None:
+        return placed
+    return (np.asarray(offsets,dtype=float)[:,np.newaxis,:]+placed).reshape(-1,2)
+
+def library_references(lib):
+    #cell name -> [(child name,origin,rotation,magnification,x_reflection,offsets)]
+    references = {}
+    for cell in lib.cells:
+        if isinstance(cell,gdstk.RawCell):
+            continue
+        refs = []
+        for ref in cell.references:
+            name = ref.cell if isinstance(ref.cell,str) else ref.cell.name
+            offsets = ref.repetition.get_offsets() if ref.repetition.size>1 else None
+            refs.append((name,np.array(ref.origin),ref.rotation,ref.magnification,ref.x_reflection,offsets))
+        references[cell.name] = refs
+    return references
+
+# GDSII record types used by the streaming reader
+_UNITS = 0x03
+_BGNSTR = 0x05
+_STRNAME = 0x06
+_ENDSTR = 0x07
+_SREF = 0x0A
+_AREF = 0x0B
+_XY = 0x10
+_ENDEL = 0x11
+_SNAME = 0x12
+_COLROW = 0x13
+_STRANS = 0x1A
+_MAG = 0x1B
+_ANGLE = 0x1C
+
+def _real8(data):
+    #GDSII 8 byte excess-64 base-16 reals
+    values = []
+    for i in range(0,len(data),8):
+        word = struct.unpack('>Q',data[i:i+8])[0]
+        sign = -1.0 if word>>63 else 1.0
+        exponent = (word>>56)&0x7f
+        mantissa = word&0x00ffffffffffffff
+        values.append(sign*mantissa/2.0**56*16.0**(exponent-64))
+    return values
+
+def _records(f,chunk=1<<20):
+    #yield (record type,data) from a GDSII stream, reading the file in chunks
+    buffer = b''
+    position = 0
+    while True:
+        while len(buffer)-position<4:
+            more = f.read(chunk)
+            if not more:
+                return
+            buffer = buffer[position:]+more
+            position = 0
+        length,record = struct.unpack_from('>HB',buffer,position)
+        if length<4:#zero padding after ENDLIB
+            return
+        while len(buffer)-position<length:
+            more = f.read(chunk)
+            if not more:
+                return
+            buffer = buffer[position:]+more
+            position = 0
+        yield record,buffer[position+4:position+length]
+        position += length
+
+def stream_references(filename):
+    '''
+    read only the references of each cell from a GDSII file, returns the same mapping as library_references
+    coordinates are in user units (normally microns)
+    '''
+    references = {}
+    unit = 1.0
+    refs = None
+    ref = None
+    with open(filename,'rb') as f:
+        for record,data in _records(f):
+            if record==_UNITS:
+                unit = _real8(data)[0]
+            elif record==_BGNSTR:
+                refs = []
+            elif record==_STRNAME:
+                references[data.rstrip(b'\0').decode('ascii')] = refs
+            elif record in (_SREF,_AREF):
+                ref = {'aref':record==_AREF,'columns':1,'rows':1,'rotation':0.0,'magnification':1.0,'x_reflection':False}
+            elif ref is None:
+                continue
+            elif record==_SNAME:
+                ref['name'] = data.rstrip(b'\0').decode('ascii')
+            elif record==_STRANS:
+                ref['x_reflection'] = bool(data[0]&0x80)
+            elif record==_MAG:
+                ref['magnification'] = _real8(data)[0]
+            elif record==_ANGLE:
+                ref['rotation'] = np.radians(_real8(data)[0])
+            elif record==_COLROW:
+                ref['columns'],ref['rows'] = struct.unpack('>hh',data)
+            elif record==_XY:
+                ref['xy'] = np.array(struct.unpack('>{}i'.format(len(data)//4),data),dtype=float).reshape(-1,2)*unit
+            elif record==_ENDEL:
+                origin = ref['xy'][0]
+                offsets = None
+                if ref['aref']:#displacements are given by the far corner points of the array
+                    column = (ref['xy'][1]-origin)/ref['columns']
+                    row = (ref['xy'][2]-origin)/ref['rows']
+                    i,j = np.meshgrid(np.arange(ref['columns']),np.arange(ref['rows']),indexing='ij')
+                    offsets = i.reshape(-1,1)*column+j.reshape(-1,1)*row
+                refs.append((ref['name'],origin,ref['rotation'],ref['magnification'],ref['x_reflection'],offsets))
+                ref = None
+    return references
+
+def flatten(references,target,top=None):
+    '''
+    absolute coordinates of every instance of the target cell
+    references maps each cell name to its references, top is a list of cells to start from (default all top level cells)
+    '''
+    if top is None:
+        children = {ref[0] for refs in references.values() for ref in refs}
+        top = [name for name in references if name not in children]
+    placements = {}#cell name -> target origins in that cell's coordinates
+    def place(name):
+        if name not in placements:
+            found = [np.zeros((0,2))]
+            for child,origin,rotation,magnification,x_reflection,offsets in references.get(name,[]):
+                points = np.zeros((1,2)) if child==target else place(child)
+                if points.shape[0]:
+                    found.append(_transform(points,origin,rotation,magnification,x_reflection,offsets))
+            placements[name] = np.concatenate(found)
+        return placements[name]
+    return np.concatenate([np.zeros((0,2))]+[place(name) for name in top])
+
+def extract(filename,target,top=None,stream=False):
+    #coordinates of every instance of target in the layout file
+    if stream:
+        references = stream_references(filename)
+    else:
+        references = library_references(gdstk.read_gds(filename,filter=set()))#references only, no geometry
+    return flatten(references,target,top=top)
+
+if __name__ == '__main__':
+    coords = extract(input_file,input_cell,stream=stream)
+    save_coordinates(output_file,coords)
+    if output_binary:
+        save_coordinates(os.path.splitext(output_file)[0]+'.npy',coords)
+    print('extracted {} coordinates'.format(coords.shape[0]))
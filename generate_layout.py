@@ -2,18 +2,27 @@ import gdstk
 import numpy as np
 import pandas as pd
 import datetime
+import os
+from wafer import Wafer
+from coordinates import save_coordinates
 
 '''
-This version uses polar magnitude only to decide if a structure's bounding box is within a wafer region.  Additional wafer features such as major and minor flats and notches are not taken into account.
+A structure's bounding box is placed if it lies within the wafer outline.  By default only the polar magnitude is used, supply a wafer.Wafer outline to also take major and minor flats, notches and keep-out regions into account.
 '''
 
 input_file = 'probes_4x2_240um.gds'
 input_cell_name = 'probes_4x2_240um'
 output_file = 'layout.gds'
 output_coords = 'layout_coords.csv'
+output_binary = False#also write the coordinates as a memory-mappable .npy beside the csv
 output_wafer = 100.0#mm
 output_edge_exclusion = 1000.0
 output_spacing = 500.0
+output_flats = False#use the SEMI flats (<=150mm) or notch (>150mm) for the wafer size
+output_secondary_flat = None#angle in degrees of the secondary flat, None for primary only
+output_keepouts = []#list of polygons [[x,y],...] in microns where no structure may be placed
+output_optimise = False#search grid offsets for the placement with the most structures
+output_rotate = False#also try the input cell rotated by 90 degrees when optimising
 
 include_timestamp = False
 
@@ -26,17 +35,13 @@ if include_timestamp:
     output_coords = t + '-' + output_coords
 
 
-def _in_wafer(coords,radius,exclusion=0.0):
-        radius -= exclusion
-        for coord in coords:#for each coord of bounding box
-            mag = np.sqrt(np.sum(coord**2)) 
-            if mag>radius:
-                return False
-        return True
-
-def populate(geometry,wafer=100.0,exclusion=0.0,spacing=0.0,vspacing=None,hspacing=None):
+def populate(geometry,wafer=100.0,exclusion=0.0,spacing=0.0,vspacing=None,hspacing=None,outline=None,offset=(0.0,0.0)):
     #geometry is bbox [[x_min,y_min],[x_max,y_max]]
-    wafer_diameter = wafer * 1000.0#db units microns
+    #outline is a wafer.Wafer, if supplied it replaces wafer and exclusion
+    #offset shifts the grid away from its anchor at -wafer_diameter/2
+    if outline is None:
+        outline = Wafer(wafer,exclusion)
+    wafer_diameter = outline.diameter * 1000.0#db units microns
     if vspacing==None or hspacing==None:
         vspacing = spacing
         hspacing = spacing
@@ -47,25 +52,146 @@ def populate(geometry,wafer=100.0,exclusion=0.0,spacing=0.0,vspacing=None,hspaci
     bbox_coords = np.row_stack([ll,lr,ul,ur])
     x_interval = (geometry[1][0]+hspacing)-(geometry[0][0]-hspacing)
     y_interval = (geometry[1][1]+vspacing)-(geometry[0][1]-vspacing)
-    x = np.arange(-wafer_diameter/2.0,wafer_diameter/2.0,x_interval)
-    y = np.arange(-wafer_diameter/2.0,wafer_diameter/2.0,y_interval)
-    x,y = np.meshgrid(x,y)
-    coords = np.column_stack([x.ravel(),y.ravel()])
-    output = []
-    for coord in coords:
-        if _in_wafer(coord+bbox_coords,wafer_diameter/2.0,exclusion=exclusion):
-            output.append(coord)
-    return np.array(output)
+    x = np.arange(-wafer_diameter/2.0,wafer_diameter/2.0,x_interval)+offset[0]
+    y = np.arange(-wafer_diameter/2.0,wafer_diameter/2.0,y_interval)+offset[1]
+    radius = outline.radius
+    #a corner outside the radius in y alone rejects the whole row
+    rows = np.all(np.abs(y[:,np.newaxis]+bbox_coords[:,1])<=radius,axis=1)
+    y = y[rows]
+    #test every corner of every remaining site in one pass, row major like meshgrid
+    inside = np.ones((y.size,x.size),dtype=bool)
+    for dx,dy in bbox_coords:
+        inside &= np.sqrt((x+dx)**2+(y[:,np.newaxis]+dy)**2)<=radius
+    iy,ix = np.nonzero(inside)
+    coords = np.column_stack([x[ix],y[iy]])
+    if not outline.plain():#flats, notch and keep-outs on the sites left inside the circle
+        coords = coords[outline.contains(coords[:,np.newaxis,:]+bbox_coords)]
+    return coords
+
+def _rotate_bbox(geometry):
+    #bounding box of the cell after a 90 degree rotation about its origin
+    (x_min,y_min),(x_max,y_max) = geometry
+    return np.array([[-y_max,x_min],[-y_min,x_max]])
+
+def count_sites(geometry,outline,spacing=0.0,vspacing=None,hspacing=None,offsets=((0.0,0.0),)):
+    '''
+    number of sites populate would place at each grid offset, all offsets are counted together from the
+    chord of the circle and flats at each row. keep-outs and the notch are not included in the count
+    '''
+    if vspacing==None or hspacing==None:
+        vspacing = spacing
+        hspacing = spacing
+    wafer_diameter = outline.diameter * 1000.0
+    dx = np.array([geometry[0][0]-hspacing,geometry[1][0]+hspacing])
+    dy = np.array([geometry[0][1]-vspacing,geometry[1][1]+vspacing])
+    x_interval = dx[1]-dx[0]
+    y_interval = dy[1]-dy[0]
+    nx = np.arange(-wafer_diameter/2.0,wafer_diameter/2.0,x_interval).size
+    offsets = np.asarray(offsets,dtype=float)
+    #[offset,row] heights of every row for every offset
+    y = np.arange(-wafer_diameter/2.0,wafer_diameter/2.0,y_interval)+offsets[:,1,np.newaxis]
+    lower_left,lower_right = outline.chord(y+dy[0])
+    upper_left,upper_right = outline.chord(y+dy[1])
+    #range of grid origins in each row that keeps both sides of the box inside
+    left = np.maximum(lower_left,upper_left)-dx[0]+wafer_diameter/2.0-offsets[:,0,np.newaxis]
+    right = np.minimum(lower_right,upper_right)-dx[1]+wafer_diameter/2.0-offsets[:,0,np.newaxis]
+    with np.errstate(invalid='ignore'):
+        first = np.clip(np.ceil(left/x_interval),0,nx)
+        last = np.clip(np.floor(right/x_interval),-1,nx-1)
+    counts = np.where(np.isfinite(left)&np.isfinite(right),np.maximum(last-first+1,0),0)
+    return counts.sum(axis=1).astype(int)
+
+def optimise_offset(geometry,outline,spacing=0.0,vspacing=None,hspacing=None,steps=50,rotate=False,candidates=10):
+    '''
+    search a steps x steps lattice of grid offsets over one pitch for the placement with the most sites
+    the best candidates from the batched count are re-checked with populate so the notch and keep-outs are included
+    returns the coordinates, the offset and True if the cell should be rotated by 90 degrees
+    '''
+    if vspacing==None or hspacing==None:
+        vspacing = spacing
+        hspacing = spacing
+    options = [(geometry,False)]
+    if rotate:
+        options.append((_rotate_bbox(geometry),True))
+    results = []
+    for bbox,rotated in options:
+        x_interval = (bbox[1][0]+hspacing)-(bbox[0][0]-hspacing)
+        y_interval = (bbox[1][1]+vspacing)-(bbox[0][1]-vspacing)
+        ox,oy = np.meshgrid(np.arange(steps)*x_interval/steps,np.arange(steps)*y_interval/steps)
+        offsets = np.column_stack([ox.ravel(),oy.ravel()])
+        counts = count_sites(bbox,outline,vspacing=vspacing,hspacing=hspacing,offsets=offsets)
+        for i in np.argsort(-counts,kind='stable')[:candidates]:
+            coords = populate(bbox,vspacing=vspacing,hspacing=hspacing,outline=outline,offset=offsets[i])
+            results.append((coords.shape[0],coords,offsets[i],rotated))
+    best = max(results,key=lambda r:r[0])#first of equal counts, so no rotation or offset is preferred
+    return best[1:]
+
+def grid_pitch(geometry,spacing=0.0,vspacing=None,hspacing=None):
+    #distance between neighbouring sites placed by populate
+    if vspacing==None or hspacing==None:
+        vspacing = spacing
+        hspacing = spacing
+    return np.array([(geometry[1][0]+hspacing)-(geometry[0][0]-hspacing),(geometry[1][1]+vspacing)-(geometry[0][1]-vspacing)])
+
+def array_references(cell,coords,pitch,rotation=0.0):
+    '''
+    one arrayed reference for each rectangular block of sites instead of one reference per site
+    coords are in the row major order produced by populate, pitch is the grid spacing [x,y]
+    '''
+    coords = np.asarray(coords,dtype=float).reshape(-1,2)
+    if coords.shape[0]==0:
+        return []
+    tolerance = 1e-6*np.min(pitch)
+    #split into runs of neighbouring sites along each row
+    step = np.diff(coords,axis=0)
+    breaks = np.nonzero((np.abs(step[:,1])>tolerance)|(np.abs(step[:,0]-pitch[0])>tolerance))[0]+1
+    starts = np.concatenate([[0],breaks])
+    lengths = np.diff(np.concatenate([starts,[coords.shape[0]]]))
+    #stack runs with the same start and length in neighbouring rows into one block
+    blocks = []
+    open_blocks = {}#(x start,columns) -> index into blocks of the block ending on the previous row
+    for start,columns in zip(starts,lengths):
+        x,y = coords[start]
+        key = (int(round(x/tolerance)),int(columns))
+        i = open_blocks.get(key)
+        if i is not None and abs(blocks[i][0][1]+blocks[i][2]*pitch[1]-y)<=tolerance:
+            blocks[i][2] += 1
+        else:
+            blocks.append([coords[start],int(columns),1])
+            i = len(blocks)-1
+        open_blocks[key] = i
+    references = []
+    for origin,columns,rows in blocks:
+        reference = gdstk.Reference(cell,origin=origin,rotation=rotation)
+        if columns>1 or rows>1:#repetition spacing is in layout coordinates, unaffected by the rotation
+            reference.repetition = gdstk.Repetition(columns=columns,rows=rows,spacing=pitch)
+        references.append(reference)
+    return references
 
-input_lib = gdstk.read_gds(input_file)
-input_cell = input_lib[input_cell_name]
-output_lib = gdstk.Library()
-top = output_lib.new_cell('Top')
-output_lib.add(input_cell)
-coords = populate(input_cell.bounding_box(),wafer=output_wafer,exclusion=output_edge_exclusion,spacing=output_spacing)
-for coord in coords:
-    top.add(gdstk.Reference(input_cell,origin=coord))
+if __name__ == '__main__':
+    input_lib = gdstk.read_gds(input_file)
+    input_cell = input_lib[input_cell_name]
+    output_lib = gdstk.Library()
+    top = output_lib.new_cell('Top')
+    output_lib.add(input_cell)
+    if output_flats:
+        outline = Wafer.semi(output_wafer,output_edge_exclusion,secondary=output_secondary_flat,keepouts=output_keepouts)
+    else:
+        outline = Wafer(output_wafer,output_edge_exclusion,keepouts=output_keepouts)
+    rotation = 0.0
+    if output_optimise:
+        coords,offset,rotated = optimise_offset(input_cell.bounding_box(),outline,spacing=output_spacing,rotate=output_rotate)
+        rotation = np.pi/2.0 if rotated else 0.0
+        print('grid offset {} rotated {}: {} structures'.format(offset,rotated,coords.shape[0]))
+    else:
+        coords = populate(input_cell.bounding_box(),spacing=output_spacing,outline=outline)
+    bbox = input_cell.bounding_box()
+    if rotation:
+        bbox = _rotate_bbox(bbox)
+    top.add(*array_references(input_cell,coords,grid_pitch(bbox,spacing=output_spacing),rotation=rotation))
 
-#write out files
-output_lib.write_gds(output_file)
-np.savetxt(output_coords,coords,delimiter=',',header='x,y')
+    #write out files
+    output_lib.write_gds(output_file)
+    save_coordinates(output_coords,coords)
+    if output_binary:
+        save_coordinates(os.path.splitext(output_coords)[0]+'.npy',coords)
@@ -1,3 +1,4 @@
+import itertools
 import gdstk
 import numpy as np
 import pandas as pd
@@ -8,33 +9,76 @@ import pandas as pd
 rows = 2
 cols = 4
 pad_side = 120#micron
-pad_sides = np.array([pad_side,pad_side])
 pitch = 240#micron
-gap = pitch-pad_side 
 layer = 0#GDS layer to create the geometry on
-name = 'probes_{cols}x{rows}_{pitch}um'.format(cols=cols,rows=rows,pitch=pitch)
 origin = np.array((0,0))
 
-# The GDSII file is called a library, which contains multiple cells.
-lib = gdstk.Library()
+#Batch mode, set to a list of parameter sets to write every probecard into one library, e.g.
+#batch = [dict(rows=2,cols=4,pitch=240),dict(rows=2,cols=4,pitch=480),dict(rows=2,cols=8,pitch=240)]
+#probe_variants below builds every combination of lists of parameters
+batch = None
+batch_file = 'probes.gds'
 
-# Geometry must be placed in cells.
-cell = lib.new_cell(name)
 
+def _size(value):
+    #a length or an [x,y] pair of lengths as 240 or 240x480
+    return 'x'.join('{:g}'.format(v) for v in np.atleast_1d(value))
 
-# Calculate the dimensions of the structure
-width = (pad_side+gap)*(cols-1)
-height = (pad_side+gap)*(rows-1)
+def probe_name(rows,cols,pitch,pad_side=120,layer=0,origin=(0,0)):
+    #parameters other than the defaults are added to the name so every variant of a batch is distinct
+    name = 'probes_{cols}x{rows}_{pitch}um'.format(cols=cols,rows=rows,pitch=_size(pitch))
+    if np.any(np.asarray(pad_side)!=120):
+        name += '_pad{}um'.format(_size(pad_side))
+    if layer!=0:
+        name += '_L{}'.format(layer)
+    if np.any(np.asarray(origin)!=0):
+        name += '_at{}um'.format(_size(origin))
+    return name
 
-# Generate coordinates of each contact
-cx = np.linspace(origin[0]-width/2.0,origin[0]+width/2.0,num=cols)#centre of each pad
-cy = np.linspace(origin[1]-height/2.0,origin[1]+height/2.0,num=rows)#centre of each pad
-cx,cy = np.meshgrid(cx,cy)
-coords = np.column_stack([cx.flatten(),cy.flatten()])
+def probe_card(rows=2,cols=4,pad_side=120,pitch=240,layer=0,origin=(0,0),name=None):
+    '''
+    cell with a rows x cols array of square contact pads centred on origin
+    pad_side and pitch may also be given as [x,y] pairs; the pads are a single rectangle with a repetition
+    '''
+    if name is None:
+        name = probe_name(rows,cols,pitch,pad_side,layer,origin)
+    pad_sides = np.broadcast_to(np.asarray(pad_side,dtype=float),(2,))
+    pitches = np.broadcast_to(np.asarray(pitch,dtype=float),(2,))
+    # Calculate the dimensions of the structure
+    size = pitches*[cols-1,rows-1]
+    first = np.asarray(origin,dtype=float)-size/2.0#centre of the lower left pad
+    pad = gdstk.rectangle(first-pad_sides/2.0,first+pad_sides/2.0,layer=layer)
+    if rows>1 or cols>1:
+        pad.repetition = gdstk.Repetition(columns=cols,rows=rows,spacing=pitches)
+    cell = gdstk.Cell(name)
+    cell.add(pad)
+    return cell
 
-# Create the geometry (a single rectangle) and add it to the cell.
-for coord in coords:
-    cell.add(gdstk.rectangle(coord-pad_sides/2.0,coord+pad_sides/2.0,layer=layer))
+def probe_variants(**parameters):
+    #every combination of the supplied parameter lists, e.g. probe_variants(cols=[4,6,8],pitch=[240,480])
+    names = list(parameters)
+    return [dict(zip(names,values)) for values in itertools.product(*[parameters[n] for n in names])]
 
-#write out file
-lib.write_gds(name+'.gds')
+def probe_library(variants,lib=None):
+    #add a probecard cell for each parameter set to one library
+    if lib is None:
+        lib = gdstk.Library()
+    names = {cell.name for cell in lib.cells}
+    for variant in variants:
+        cell = probe_card(**variant)
+        if cell.name in names:
+            raise ValueError('duplicate probecard cell name {}, supply a name for this variant'.format(cell.name))
+        names.add(cell.name)
+        lib.add(cell)
+    return lib
+
+if __name__ == '__main__':
+    if batch is None:
+        # The GDSII file is called a library, which contains multiple cells.
+        lib = probe_library([dict(rows=rows,cols=cols,pad_side=pad_side,pitch=pitch,layer=layer,origin=origin)])
+        #write out file
+        lib.write_gds(probe_name(rows,cols,pitch,pad_side,layer,origin)+'.gds')
+    else:
+        lib = probe_library(batch)
+        lib.write_gds(batch_file)
+        print('wrote {} probecards to {}'.format(len(batch),batch_file))
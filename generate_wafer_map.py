@@ -0,0 +1,101 @@
+import gdstk
+import numpy as np
+import pandas as pd
+import datetime
+from wafer import Wafer
+from coordinates import load_coordinates,save_coordinates
+from generate_layout import populate,array_references,grid_pitch
+from extract_coords import flatten,library_references
+
+'''
+Step a die (or reticle) cell across the wafer and list every structure on every die.
+
+The structures of one die are taken from a die-relative coordinate table in the AgCl format (design,wafer,die,block,material,structure,x,y), only the rows of the first die are used as the template.
+Without a table the origins of the structure_cells inside the die cell are used, with the cell name as the structure and structure_material as the material (one of the materials with driving currents in agcl_example.py).
+The GDS output keeps the hierarchy: the top cell holds arrayed references of the die cell.
+The coordinate table has one row per structure per die with absolute x,y and can be passed directly to agcl_example.py.
+'''
+
+input_file = 'die.gds'
+die_cell_name = 'die'
+structures_file = 'AgAgCl_TS_Kelvin_R2_00_03.csv'#die-relative structure table, None to read structure_cells from the die
+structure_cells = []
+structure_material = 'Pt'#material of the structure_cells, agcl_example.py needs a material it has currents for
+design = 'AgAgCl_TS_Kelvin_R2'
+wafer_number = 0
+output_file = 'wafer.gds'
+output_coords = 'wafer_coords.csv'
+output_wafer = 100.0#mm
+output_edge_exclusion = 1000.0
+output_street = 200.0#gap between neighbouring dies
+output_flats = False#use the SEMI flats (<=150mm) or notch (>150mm) for the wafer size
+
+include_timestamp = False
+
+def timestamp():
+    return datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+
+if include_timestamp:
+    t = timestamp()
+    output_file = t + '-' + output_file
+    output_coords = t + '-' + output_coords
+
+
+def die_template(table):
+    #die-relative structures of the first die in a coordinate table, without the wafer level columns
+    if 'die' in table.columns:
+        table = table[table['die']==table['die'].iloc[0]]
+    return table.drop(columns=[c for c in ('design','wafer','die') if c in table.columns]).reset_index(drop=True)
+
+def cell_template(die_cell,names,material):
+    #die-relative origins of each named cell in the die
+    if not material:
+        raise ValueError('structure cells need a material to be measured')
+    lib = gdstk.Library()
+    lib.add(die_cell,*die_cell.dependencies(True))
+    references = library_references(lib)
+    tables = []
+    for name in names:
+        xy = flatten(references,name,top=[die_cell.name])
+        tables.append(pd.DataFrame({'block':0,'material':material,'structure':name,'x':xy[:,0],'y':xy[:,1]}))
+    return pd.concat(tables,ignore_index=True)
+
+def wafer_map(die_origins,template,design='',wafer=0):
+    '''
+    one row per structure per die, structures are offset by every die origin at once
+    die numbers follow the row major order of die_origins
+    '''
+    die_origins = np.asarray(die_origins,dtype=float).reshape(-1,2)
+    dies = die_origins.shape[0]
+    xy = (die_origins[:,np.newaxis,:]+template[['x','y']].to_numpy(dtype=float)[np.newaxis,:,:]).reshape(-1,2)
+    table = {'design':np.full(dies*len(template),design),'wafer':wafer,'die':np.repeat(np.arange(dies),len(template))}
+    for column in template.columns:
+        if column not in ('x','y'):
+            table[column] = np.tile(template[column].to_numpy(),dies)
+    table['x'] = xy[:,0]
+    table['y'] = xy[:,1]
+    return pd.DataFrame(table)
+
+if __name__ == '__main__':
+    input_lib = gdstk.read_gds(input_file)
+    die_cell = input_lib[die_cell_name]
+    output_lib = gdstk.Library()
+    top = output_lib.new_cell('Top')
+    output_lib.add(die_cell,*die_cell.dependencies(True))
+    if output_flats:
+        outline = Wafer.semi(output_wafer,output_edge_exclusion)
+    else:
+        outline = Wafer(output_wafer,output_edge_exclusion)
+    bbox = die_cell.bounding_box()
+    die_origins = populate(bbox,spacing=output_street/2.0,outline=outline)
+    top.add(*array_references(die_cell,die_origins,grid_pitch(bbox,spacing=output_street/2.0)))
+    if structures_file is None:
+        template = cell_template(die_cell,structure_cells,structure_material)
+    else:
+        template = die_template(load_coordinates(structures_file))
+    table = wafer_map(die_origins,template,design=design,wafer=wafer_number)
+
+    #write out files
+    output_lib.write_gds(output_file)
+    save_coordinates(output_coords,table)
+    print('{} dies, {} structures'.format(die_origins.shape[0],len(table)))
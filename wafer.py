@@ -0,0 +1,115 @@
+import numpy as np
+
+'''
+Wafer outline used to decide if a structure's bounding box can be placed.
+
+The usable region is the wafer circle less the edge exclusion, cut by any flats (half planes), with the notch and any keep-out polygons removed.
+Circle and flats are convex so a bounding box is inside them when all four corners are.
+The notch and keep-outs are tested as polygons against the whole bounding box, using precomputed polygon edges and bounding boxes so only nearby sites get the exact test.
+
+Wafer diameter is in mm, all other lengths are in microns (GDS db units) to match generate_layout.populate.
+'''
+
+#SEMI M1 flat lengths in microns, primary flat is at 270 degrees (bottom of the wafer)
+semi_flats = {50.8:(15880.0,8000.0),76.2:(22220.0,11180.0),100.0:(32500.0,18000.0),125.0:(42500.0,27500.0),150.0:(57500.0,37500.0)}
+semi_notch_depth = 1000.0#200 and 300mm wafers, 90 degree notch at 270 degrees
+
+
+def notch_polygon(radius,depth=semi_notch_depth,angle=270.0,opening=90.0,exclusion=0.0):
+    #V shaped notch cut into the edge at angle, grown by the exclusion so the edge exclusion follows the notch
+    theta = np.radians(angle)
+    half = np.radians(opening)/2.0
+    apex = radius-depth-exclusion/np.sin(half)
+    reach = radius+exclusion+depth#extend beyond the edge so the whole cut is covered
+    side = (reach-apex)*np.tan(half)
+    u = np.array([np.cos(theta),np.sin(theta)])#outward
+    v = np.array([-u[1],u[0]])
+    return np.vstack([apex*u,reach*u+side*v,reach*u-side*v])
+
+class Wafer:
+    '''
+    wafer outline: circle with edge exclusion, optional flats, notch and keep-out polygons
+    '''
+    def __init__(self,diameter=100.0,exclusion=0.0,flats=None,notch=None,keepouts=None):
+        self.diameter = diameter#mm
+        self.exclusion = exclusion
+        self.radius = diameter*1000.0/2.0-exclusion#usable radius in microns
+        #flats are (length,angle in degrees) stored as outward normal and usable distance from centre
+        flats = [] if flats is None else flats
+        edge = diameter*1000.0/2.0
+        self.flat_normals = np.array([[np.cos(np.radians(a)),np.sin(np.radians(a))] for l,a in flats]).reshape(-1,2)
+        self.flat_limits = np.array([np.sqrt(edge**2-(l/2.0)**2)-exclusion for l,a in flats])
+        polygons = [] if keepouts is None else [np.asarray(p,dtype=float) for p in keepouts]
+        if notch is not None:#angle of the notch in degrees
+            polygons.append(notch_polygon(edge,angle=notch,exclusion=exclusion))
+        self.keepouts = polygons
+        #precomputed spatial index, bounding box and edges of each polygon
+        self.keepout_bboxes = np.array([[p.min(axis=0),p.max(axis=0)] for p in polygons]).reshape(-1,2,2)
+        self.keepout_edges = [(p,np.roll(p,-1,axis=0)) for p in polygons]
+
+    @classmethod
+    def semi(cls,diameter=100.0,exclusion=0.0,secondary=None,keepouts=None):
+        #standard outline: flats up to 150mm, notch for larger wafers. secondary is the angle of the secondary flat if present
+        if diameter in semi_flats:
+            primary,second = semi_flats[diameter]
+            flats = [(primary,270.0)]
+            if secondary is not None:
+                flats.append((second,secondary))
+            return cls(diameter,exclusion,flats=flats,keepouts=keepouts)
+        return cls(diameter,exclusion,notch=270.0,keepouts=keepouts)
+
+    def plain(self):
+        #True if only the circle needs testing
+        return self.flat_limits.size==0 and len(self.keepouts)==0
+
+    def chord(self,y):
+        #extent [left,right] in x of the circle and flats at each height y, left>right where there is none
+        y = np.asarray(y,dtype=float)
+        with np.errstate(invalid='ignore'):
+            right = np.sqrt(self.radius**2-y**2)
+        right = np.where(np.abs(y)<=self.radius,right,-np.inf)
+        left = -right
+        for (nx,ny),limit in zip(self.flat_normals,self.flat_limits):
+            if np.isclose(nx,0.0):
+                right = np.where(ny*y<=limit,right,-np.inf)
+            elif nx>0:
+                right = np.minimum(right,(limit-ny*y)/nx)
+            else:
+                left = np.maximum(left,(limit-ny*y)/nx)
+        return left,right
+
+    def contains(self,corners):
+        #corners is [site,corner,xy] of each bounding box, returns a boolean per site
+        corners = np.asarray(corners,dtype=float)
+        inside = np.all(np.sqrt(np.sum(corners**2,axis=-1))<=self.radius,axis=-1)
+        if self.flat_limits.size:
+            inside &= np.all(corners@self.flat_normals.T<=self.flat_limits,axis=(-2,-1))
+        if self.keepouts:
+            lower = corners.min(axis=-2)
+            upper = corners.max(axis=-2)
+            inside[inside] = ~self._overlaps(lower[inside],upper[inside])
+        return inside
+
+    def _overlaps(self,lower,upper):
+        #True where a rectangle [lower,upper] touches any keep-out polygon
+        hit = np.zeros(lower.shape[0],dtype=bool)
+        for (bl,bu),(a,b) in zip(self.keepout_bboxes,self.keepout_edges):
+            near = np.nonzero(np.all((lower<=bu)&(upper>=bl),axis=1)&~hit)[0]
+            if near.size==0:
+                continue
+            lo = lower[near][:,np.newaxis,:]#[site,edge,xy]
+            hi = upper[near][:,np.newaxis,:]
+            #an edge crosses the rectangle if their boxes overlap and the rectangle straddles the edge line
+            boxes = np.all((np.minimum(a,b)<=hi)&(np.maximum(a,b)>=lo),axis=2)
+            normal = np.column_stack([b[:,1]-a[:,1],a[:,0]-b[:,0]])
+            side = [np.sum((np.stack([cx,cy],axis=-1)-a)*normal,axis=-1) for cx in (lo[...,0],hi[...,0]) for cy in (lo[...,1],hi[...,1])]
+            side = np.stack(side)
+            crossing = boxes&~(np.all(side>0,axis=0)|np.all(side<0,axis=0))
+            #otherwise the rectangle can only touch the polygon by lying wholly inside it
+            centre = (lo+hi)/2.0
+            spans = (a[:,1]>centre[...,1])!=(b[:,1]>centre[...,1])
+            with np.errstate(divide='ignore',invalid='ignore'):
+                cross_x = a[:,0]+(centre[...,1]-a[:,1])*(b[:,0]-a[:,0])/(b[:,1]-a[:,1])
+            enclosed = np.sum(spans&(centre[...,0]<cross_x),axis=1)%2==1
+            hit[near] = np.any(crossing,axis=1)|enclosed
+        return hit